@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""Benchmarks for tim, run from the repository root:
+
+    python bench.py [BENCHMARK...] [--days N] [--events N] [--output FILE] [--check]
+    python bench.py parallel [--jobs N]
+    python bench.py engines
+    python bench.py stress [--writers N] [--records N] [--rewrites N] [--format json|binary]
+    python bench.py compare OLD.json NEW.json
+
+Benchmarks: startup, insert, load_file, cat, summarize, save_file, completion (all of them by default).
+
+Every benchmark works on a synthetic history generated in a temporary directory, nothing under ~/.config/tim is
+touched. Results are printed (or written to --output) as json, so runs of different commits can be compared with the
+compare command. --check exits with an error when the startup overhead is over startup_budget_ms. stress exits with
+an error when concurrent writers lose or duplicate a sample.
+"""
+
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import timedelta
+
+from timlib import core as tim
+from timlib.api import Tim
+from timlib.cli import parse_options
+
+# Startup of the append path, on top of a bare interpreter start
+startup_budget_ms = 40
+
+summary_ranges = [7, 30, 365, 1825]
+
+
+# ------ Synthetic history
+
+def generate_history(root: str, days: int, events_per_day: int = 20, tags: int = 12, issues: int = 40,
+                     end_ratio: float = 0.9, jira_ratio: float = 0.7, seed: int = 1):
+    """Writes <days> day files ending today under root, in the same layout as tim_dir. Weekends are skipped, a day
+    has about <events_per_day> activities drawn from vocabularies of <tags> tags and <issues> issues, <end_ratio> of
+    the days are ended and <jira_ratio> of the issues are flagged as synced or skipped """
+    rnd = random.Random(seed)
+    tag_names = ['tag_{}'.format(i) for i in range(tags)] + ['dev/backend', 'dev/frontend']
+    issue_keys = ['#PRJ-{}'.format(1000 + i) for i in range(issues)]
+    words = ['fixing', 'reviewing', 'deploying', 'jenkins', 'tests', 'meeting', 'mail', 'standup', 'refactoring']
+    with open(root + '/tags', 'w') as f:
+        f.write("\n".join(tag_names) + "\n")
+    for x in range(days):
+        date = tim.current_time() - timedelta(days=x)
+        if date.weekday() >= 5:
+            continue
+        path = '{}/{}/{}/{}.dat'.format(root, date.year, date.month, date.day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        minutes = 8 * 60 + rnd.randint(0, 90)
+        step = max(1, 600 // max(1, events_per_day))
+        with open(path, 'w') as f:
+            for _ in range(max(1, int(rnd.gauss(events_per_day, events_per_day / 5)))):
+                text = ' '.join(rnd.sample(words, 2))
+                if rnd.random() < 0.4:
+                    text = rnd.choice(issue_keys) + ' ' + text
+                issue = text.startswith('#')
+                tag = rnd.choice(tag_names) if rnd.random() < 0.95 else None
+                sample = tim.Sample(min(minutes, 23 * 60), text, tag, None, issue and rnd.random() < jira_ratio,
+                                    issue and rnd.random() < 0.05)
+                f.write(sample.to_json() + "\n")
+                minutes += rnd.randint(1, 2 * step)
+            if rnd.random() < end_ratio:
+                f.write(tim.Sample(min(minutes, 23 * 60 + 59), None, None, 'END').to_json() + "\n")
+
+
+# ------ Helpers
+
+def timed(fn, repeat: int = 1) -> float:
+    """Best wall time of <repeat> runs, in seconds """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def use_data_dir(root: str):
+    tim.activate(tim.Context(root))
+
+
+def quiet(fn):
+    with redirect_stdout(io.StringIO()):
+        fn()
+
+
+def cold_summary(days: int, jobs: int):
+    """Summarizes the last <days> days without a cache, in batch mode """
+    shutil.rmtree(tim.data_dir() + 'cache', ignore_errors=True)
+    storage = tim.FileStorage()
+    storage.summarize(0, days - 1, None, jobs)
+
+
+def busiest_day(root: str) -> str:
+    paths = [os.path.join(d, name) for (d, _, names) in os.walk(root) for name in names if name.endswith('.dat')]
+    return max(paths, key=os.path.getsize)
+
+
+# ------ Benchmarks
+
+def bench_startup(root: str) -> dict:
+    """Wall time of 't <MESSAGE>' in a new interpreter, compared to the interpreter alone """
+    env = dict(os.environ, HOME=root)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tim.py')
+
+    def start(command):
+        return timed(lambda: subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL), 10)
+
+    interpreter = start([sys.executable, '-c', 'pass'])
+    append = start([sys.executable, script, 'benchmark', 'message'])
+    status = start([sys.executable, script, '--status'])
+    overhead_ms = (append - interpreter) * 1000
+    return {'interpreter': interpreter, 'append': append, 'status': status, 'append_overhead_ms': overhead_ms,
+            'budget_ms': startup_budget_ms, 'within_budget': overhead_ms <= startup_budget_ms}
+
+
+def bench_insert(root: str) -> dict:
+    count = 1000
+
+    def insert_many():
+        for i in range(count):
+            tim.insert('benchmark insert {}'.format(i), tim.current_time(), 0)
+
+    def api_insert_many():
+        api = Tim(root)
+        for i in range(count):
+            api.insert('benchmark api insert {}'.format(i))
+
+    elapsed = timed(insert_many)
+    api_elapsed = timed(api_insert_many)
+    return {'count': count, 'total': elapsed, 'per_insert': elapsed / count, 'api_per_insert': api_elapsed / count}
+
+
+def bench_load_file(root: str) -> dict:
+    """Loads the busiest day, as json lines and as binary records """
+    path = busiest_day(root)
+    samples = tim.load_file(path)
+    binary_path = os.path.join(root, 'binary.dat')
+    tim.save_file(samples, binary_path, True)
+    return {'samples': len(samples), 'load_file': timed(lambda: tim.load_file(path), 20),
+            'load_batch': timed(lambda: tim.load_batch(path), 20),
+            'load_last': timed(lambda: tim.load_last(path), 20),
+            'binary_load_file': timed(lambda: tim.load_file(binary_path), 20),
+            'binary_load_batch': timed(lambda: tim.load_batch(binary_path), 20),
+            'json_bytes': os.path.getsize(path), 'binary_bytes': os.path.getsize(binary_path)}
+
+
+def bench_cat(root: str) -> dict:
+    return {'cat': timed(lambda: quiet(lambda: tim.cat(tim.current_time())), 20)}
+
+
+def bench_summarize(root: str) -> dict:
+    res = {}
+    for days in summary_ranges:
+        cold = timed(lambda: cold_summary(days, 1), 3)
+        warm = timed(lambda: tim.FileStorage().summarize(0, days - 1, None, 1), 3)
+        res[str(days)] = {'cold': cold, 'warm': warm}
+    return res
+
+
+def bench_save_file(root: str) -> dict:
+    path = busiest_day(root)
+    samples = tim.load_file(path)
+    target = os.path.join(root, 'rewrite.dat')
+    return {'samples': len(samples), 'save_file': timed(lambda: tim.save_file(samples, target), 20)}
+
+
+def bench_completion(root: str) -> dict:
+    """Completing a prefix the way readline does, asking for states until the completer gives up """
+    import readline
+    tags = ['{}/{}'.format(group, i) for group in ('dev', 'ops', 'meet', 'rest') for i in range(2500)]
+    completer = tim.create_list_completer(tags)
+    get_line_buffer = readline.get_line_buffer
+
+    def complete(prefix):
+        readline.get_line_buffer = lambda: prefix
+        try:
+            state = 0
+            while True:
+                try:
+                    if completer(prefix, state) is None:
+                        return state
+                except IndexError:
+                    return state
+                state += 1
+        finally:
+            readline.get_line_buffer = get_line_buffer
+
+    return {'tags': len(tags), 'unique_prefix': timed(lambda: complete('ops/2499'), 5),
+            'prefix_with_11_matches': timed(lambda: complete('dev/10'), 5),
+            'prefix_with_111_matches': timed(lambda: complete('dev/1'), 3)}
+
+
+benchmarks = {
+    'startup': bench_startup,
+    'insert': bench_insert,
+    'load_file': bench_load_file,
+    'cat': bench_cat,
+    'summarize': bench_summarize,
+    'save_file': bench_save_file,
+    'completion': bench_completion,
+}
+
+
+def run_benchmarks(names: [str], days: int, events: int) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as home:
+        root = home + '/.config/tim'
+        os.makedirs(root)
+        start = time.perf_counter()
+        generate_history(root, days, events)
+        results['generate_history'] = time.perf_counter() - start
+        use_data_dir(root)
+        for name in names:
+            results[name] = benchmarks[name](home if name == 'startup' else root)
+    return results
+
+
+def bench_parallel(jobs: int) -> dict:
+    """Cold summaries over growing ranges with one process and with <jobs> processes. The crossover is the shortest
+    range where the pool wins, parallel_min_days should stay close to it """
+    ranges = [7, 30, 60, 120, 365, 730, 1825]
+    min_days = tim.parallel_min_days
+    tim.parallel_min_days = 0
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            generate_history(root, ranges[-1])
+            use_data_dir(root)
+            for days in ranges:
+                serial = timed(lambda: cold_summary(days, 1), 3)
+                parallel = timed(lambda: cold_summary(days, jobs), 3)
+                rows.append({'days': days, 'serial': serial, 'parallel': parallel})
+    finally:
+        tim.parallel_min_days = min_days
+    crossover = next((row['days'] for row in rows if row['parallel'] < row['serial']), None)
+    return {'jobs': jobs, 'parallel_min_days': min_days, 'crossover_days': crossover, 'ranges': rows}
+
+
+def bench_engines() -> dict:
+    """Summaries of growing ranges of uncached days with the Python and the numpy engines, in one process. The
+    crossover is the shortest range where numpy wins, numpy_min_days should stay close to it """
+    import numpy
+    ranges = [30, 365, 1825, 3650, 10000]
+    rows = []
+    with tempfile.TemporaryDirectory() as root:
+        generate_history(root, ranges[-1])
+        use_data_dir(root)
+        paths = [tim.date_to_path(date) for date in sorted(tim.FileStorage().dates(), reverse=True)]
+        for days in ranges:
+            chunk = paths[:days]
+            python = timed(lambda: tim.day_cache_entries(chunk, False), 3)
+            vectorized = timed(lambda: tim.numpy_day_cache_entries(chunk, numpy), 3)
+            rows.append({'days': days, 'files': len(chunk), 'python': python, 'numpy': vectorized})
+    crossover = next((row['days'] for row in rows if row['numpy'] < row['python']), None)
+    return {'numpy_min_days': tim.numpy_min_days, 'crossover_days': crossover, 'ranges': rows}
+
+
+def stress_writer(root: str, writer: int, records: int):
+    use_data_dir(root)
+    for i in range(records):
+        tim.insert('writer {} record {}'.format(writer, i), tim.current_time(), 0)
+
+
+def stress_rewriter(root: str, rewrites: int):
+    """Keeps retagging today the way review does, loading the day and saving it back """
+    use_data_dir(root)
+    storage = tim.FileStorage()
+    for i in range(rewrites):
+        samples = storage.load(tim.current_time())
+        for sample in samples:
+            sample.tag = 'tag_{}'.format(i % 3)
+        storage.save(tim.current_time(), samples)
+
+
+def bench_stress(writers: int, records: int, rewrites: int) -> dict:
+    """<writers> processes append <records> samples each to today while another process rewrites the day
+    <rewrites> times. Every sample must end up in the file exactly once """
+    from concurrent.futures import ProcessPoolExecutor
+    with tempfile.TemporaryDirectory() as root:
+        start = time.perf_counter()
+        with ProcessPoolExecutor(writers + 1) as executor:
+            futures = [executor.submit(stress_writer, root, writer, records) for writer in range(writers)]
+            futures.append(executor.submit(stress_rewriter, root, rewrites))
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+        use_data_dir(root)
+        messages = [sample.message for sample in tim.load_file(tim.date_to_path(tim.current_time()))]
+    expected = set('writer {} record {}'.format(writer, i) for writer in range(writers) for i in range(records))
+    lost = len(expected - set(messages))
+    duplicated = len(messages) - len(set(messages))
+    return {'format': tim.data_format(), 'writers': writers, 'records': records, 'rewrites': rewrites,
+            'elapsed': elapsed, 'appends_per_second': writers * records / elapsed, 'lost': lost,
+            'duplicated': duplicated, 'ok': lost == 0 and duplicated == 0}
+
+
+def compare(old: dict, new: dict, prefix: str = ''):
+    """Prints the ratio new/old of every timing present in both results """
+    for key in old:
+        if key not in new:
+            continue
+        if isinstance(old[key], dict) and isinstance(new[key], dict):
+            compare(old[key], new[key], prefix + key + '.')
+        elif isinstance(old[key], float) and isinstance(new[key], float) and old[key] > 0:
+            print('{:<50s} {:10.6f} {:10.6f} {:6.2f}x'.format(prefix + key, old[key], new[key], new[key] / old[key]))
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main():
+    (params, options) = parse_options(sys.argv[1:], {'--jobs': True, '--days': True, '--events': True,
+                                                     '--output': True, '--check': False, '--writers': True,
+                                                     '--records': True, '--rewrites': True, '--format': True})
+    if params is None:
+        return 1
+    if params[:1] == ['compare'] and len(params) == 3:
+        with open(params[1]) as f:
+            old = json.load(f)
+        with open(params[2]) as f:
+            new = json.load(f)
+        compare(old['results'], new['results'])
+        return 0
+
+    if params == ['parallel']:
+        results = bench_parallel(int(options.get('--jobs', os.cpu_count() or 2)))
+    elif params == ['engines']:
+        results = bench_engines()
+    elif params == ['stress']:
+        if '--format' in options:
+            os.environ['TIM_FORMAT'] = options['--format']
+        results = bench_stress(int(options.get('--writers', 8)), int(options.get('--records', 500)),
+                               int(options.get('--rewrites', 50)))
+    else:
+        names = params or list(benchmarks)
+        unknown = [name for name in names if name not in benchmarks]
+        if unknown:
+            print(__doc__)
+            return 1
+        results = run_benchmarks(names, int(options.get('--days', max(summary_ranges))),
+                                 int(options.get('--events', 20)))
+
+    report = json.dumps({'revision': git_revision(), 'python': platform.python_version(), 'time': time.time(),
+                         'results': results}, indent=2)
+    if '--output' in options:
+        with open(options['--output'], 'w') as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    if '--check' in options and 'startup' in results and not results['startup']['within_budget']:
+        print('Startup overhead {:.1f}ms is over the budget of {}ms'.format(results['startup']['append_overhead_ms'],
+                                                                          startup_budget_ms), file=sys.stderr)
+        return 1
+    if params == ['stress'] and not results['ok']:
+        print('{} samples lost and {} duplicated'.format(results['lost'], results['duplicated']), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import timlib and bench from the repository root, wherever pytest is started from
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,80 @@
+"""A local stand-in for the parts of the Jira REST API that tim uses: session login and worklogs """
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeJira(object):
+    """Serves on a free local port. Logins hand out a new session cookie, other requests of a valid session get the
+    scripted (status, headers) of self.replies first, then 201 for worklog posts and 200 for the rest. Every request
+    is recorded as (method, path, session cookie) and created worklogs as (issue key, body) """
+
+    def __init__(self):
+        self.requests = []
+        self.worklogs = []
+        self.replies = []
+        self.sessions = set()
+        self.logins = 0
+        self.delay = 0
+        self.lock = threading.Lock()
+        jira = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                jira.handle(self, 'GET')
+
+            def do_POST(self):
+                jira.handle(self, 'POST')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def expire_sessions(self):
+        with self.lock:
+            self.sessions.clear()
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str):
+        length = int(request.headers.get('Content-Length') or 0)
+        body = json.loads(request.rfile.read(length)) if length else None
+        cookie = request.headers.get('Cookie', '')
+        session = next((part.split('=', 1)[1] for part in cookie.split('; ') if part.startswith('JSESSIONID=')), None)
+        headers = {}
+        with self.lock:
+            self.requests.append((method, request.path, session))
+            if request.path == '/rest/auth/1/session' and method == 'POST':
+                self.logins += 1
+                session = 's{}'.format(self.logins)
+                self.sessions.add(session)
+                status = 200
+                headers['Set-Cookie'] = 'JSESSIONID={}; Path=/'.format(session)
+            elif session not in self.sessions:
+                status = 401
+            elif request.path == '/rest/auth/1/session':
+                status = 200
+            else:
+                worklog = request.path.endswith('/worklog') and method == 'POST'
+                (status, headers) = self.replies.pop(0) if self.replies else (201 if worklog else 200, {})
+                if worklog and status == 201:
+                    self.worklogs.append((request.path.split('/')[-2], body))
+        if self.delay:
+            # not time.sleep, tests replace it to record backoff
+            threading.Event().wait(self.delay)
+        request.send_response(status)
+        for (name, value) in headers.items():
+            request.send_header(name, value)
+        request.send_header('Content-Length', '0')
+        request.end_headers()
@@ -0,0 +1,34 @@
+"""Shared fixtures of the tests: a temporary data directory used through its own context and a fixed clock """
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from timlib import core
+
+# a wednesday afternoon, far from midnight and month ends
+fixed_now = datetime(2026, 10, 14, 15, 30)
+
+
+class DataDirTest(unittest.TestCase):
+    """Runs every test in a context on an empty data directory, at fixed_now. Nothing prompts, the messages of the
+    engine are collected in self.messages """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.messages = []
+        self.context = core.Context(self.root, lambda: fixed_now, self.messages.append, False)
+        self.scope = core.using(self.context)
+        self.scope.__enter__()
+
+    def tearDown(self):
+        self.scope.__exit__(None, None, None)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def log_day(self, days: int, samples: [(str, str, str)], end: str = None):
+        """Saves a day of (HH:MM, message, tag) samples, ended at <end> when it is given """
+        day = [core.Sample(time, message, tag) for (time, message, tag) in samples]
+        if end is not None:
+            day.append(core.Sample(end, None, None, 'END'))
+        core.get_storage().save(core.days_ago(days), day)
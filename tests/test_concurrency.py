@@ -0,0 +1,68 @@
+"""Several processes appending to a day while others rewrite and read it, like bench.py stress """
+
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+import bench
+from timlib import core
+
+writers = 4
+records = 100
+
+
+def reader(root: str, reads: int) -> int:
+    """Loads today over and over, returns the most duplicated samples seen in one load """
+    bench.use_data_dir(root)
+    storage = core.FileStorage()
+    worst = 0
+    for _ in range(reads):
+        messages = [sample.message for sample in storage.load(core.current_time())]
+        worst = max(worst, len(messages) - len(set(messages)))
+    return worst
+
+
+class ConcurrentAppendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp() + '/'
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def check_format(self, name: str):
+        with open(self.root + 'format', 'w') as f:
+            f.write(name + "\n")
+        with ProcessPoolExecutor(writers + 2) as executor:
+            futures = [executor.submit(bench.stress_writer, self.root, writer, records) for writer in range(writers)]
+            rewriter = executor.submit(bench.stress_rewriter, self.root, 20)
+            read = executor.submit(reader, self.root, 50)
+            for future in futures + [rewriter]:
+                future.result()
+            self.assertEqual(read.result(), 0)
+        with core.using(core.Context(self.root)):
+            path = core.date_to_path(core.current_time())
+            self.assertEqual(core.is_record_file(path), name == 'binary')
+            messages = [sample.message for sample in core.load_file(path)]
+        expected = ['writer {} record {}'.format(writer, i) for writer in range(writers) for i in range(records)]
+        self.assertEqual(sorted(messages), sorted(expected))
+
+    def test_json_appends(self):
+        self.check_format('json')
+
+    def test_binary_appends(self):
+        self.check_format('binary')
+
+    def test_sqlite_appends(self):
+        with open(self.root + 'storage', 'w') as f:
+            f.write("sqlite\n")
+        with ProcessPoolExecutor(8) as executor:
+            for future in [executor.submit(bench.stress_writer, self.root, writer, 200) for writer in range(8)]:
+                future.result()
+        with core.using(core.Context(self.root)):
+            storage = core.get_storage()
+            self.assertEqual(storage.name, 'sqlite')
+            messages = [sample.message for sample in storage.load(core.current_time())]
+        expected = ['writer {} record {}'.format(writer, i) for writer in range(8) for i in range(200)]
+        self.assertEqual(sorted(messages), sorted(expected))
@@ -0,0 +1,70 @@
+import json
+import os
+import socket
+import threading
+from unittest import mock
+
+from timlib import cli
+
+from helpers import DataDirTest
+
+
+class DaemonRequestTest(DataDirTest):
+    """Requests handled the way serve_daemon does, over a socket pair """
+
+    def request(self, args) -> dict:
+        (server, client) = socket.socketpair()
+        with server, client:
+            client.sendall(json.dumps(args if args is None else {'args': args}).encode('utf-8') + b'\n')
+            cli.handle_daemon_request(server)
+            server.shutdown(socket.SHUT_WR)
+            return json.loads(client.makefile('rb').read().decode('utf-8'))
+
+    def test_serves_appends_and_status(self):
+        self.assertIn('output', self.request(['t', 'coding']))
+        response = self.request(['t', '--status'])
+        self.assertIn('coding', response['output'])
+
+    def test_refuses_interactive_and_endless_commands(self):
+        with mock.patch.object(cli, 'run') as run:
+            for args in (['t', '-r'], ['t', '--watch'], ['t', '-o'], ['t', '--daemon'], ['t', '-s', '0'],
+                         ['t', '-j'], 'rm -rf', ['t', 1], None):
+                self.assertIn('error', self.request(args))
+        run.assert_not_called()
+
+    def test_served_commands_do_not_read_the_terminal(self):
+        with mock.patch.object(cli, 'run', lambda args, in_daemon: print(input('?'))):
+            response = self.request(['t', '--status'])
+        self.assertIn('EOFError', response['output'])
+
+
+class DaemonClientTest(DataDirTest):
+
+    def serve_once(self, reply: bytes = None):
+        """Listens on the daemon socket and answers one client with reply, or never when it is None """
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(cli.daemon_socket_path())
+        server.listen(1)
+        done = threading.Event()
+
+        def answer():
+            (connection, _) = server.accept()
+            with connection:
+                if reply is not None:
+                    connection.sendall(reply)
+                else:
+                    done.wait(5)
+        thread = threading.Thread(target=answer, daemon=True)
+        thread.start()
+        self.addCleanup(server.close)
+        self.addCleanup(done.set)
+
+    def test_falls_back_when_the_daemon_hangs(self):
+        self.serve_once()
+        with mock.patch.object(cli, 'daemon_timeout', 0.1):
+            self.assertFalse(cli.run_on_daemon(['t', 'coding']))
+
+    def test_falls_back_when_the_daemon_refuses(self):
+        self.serve_once(json.dumps({'error': 'not served'}).encode('utf-8'))
+        self.assertFalse(cli.run_on_daemon(['t', 'coding']))
+        self.assertTrue(os.path.exists(cli.daemon_socket_path()))
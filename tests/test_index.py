@@ -0,0 +1,69 @@
+import os
+from unittest import mock
+
+from timlib import core
+from timlib.core import Sample
+
+from helpers import DataDirTest, fixed_now
+
+
+class IndexTest(DataDirTest):
+
+    def setUp(self):
+        super().setUp()
+        core.add_tag('dev')
+        self.storage = core.get_storage()
+        self.log_day(1, [('09:00', '#PRJ-1 jenkins pipeline', 'dev'), ('10:00', 'review', 'dev')], '12:00')
+        core.rebuild_index()
+
+    def found(self, *terms) -> [(str, str)]:
+        return [(date.strftime('%Y/%m/%d'), sample.message)
+                for (date, sample, _) in core.find_matches(core.query_tokens(terms))]
+
+    def test_appended_samples_are_found(self):
+        self.storage.append(fixed_now, Sample('13:00', 'jenkins upgrade', 'dev'))
+        self.assertEqual(self.found('jenkins', 'tag:dev'),
+                         [('2026/10/13', '#PRJ-1 jenkins pipeline'), ('2026/10/14', 'jenkins upgrade')])
+
+    def test_rewritten_day_uses_its_new_generation(self):
+        date = core.days_ago(1)
+        self.storage.save(date, [Sample('09:00', 'jenkins pipeline', 'dev'), Sample('09:30', '#PRJ-1 coding', 'dev')])
+        key = core.date_key(date)
+        self.assertEqual(core.day_generations(), {key: 1})
+        self.assertEqual(core.index_lookup({'#prj-1'}), {key: {len('{}\n'.format(
+            Sample('09:00', 'jenkins pipeline', 'dev').to_json()).encode('utf-8'))}})
+        self.assertEqual(self.found('#PRJ-1', 'jenkins'), [])
+
+    def test_offsets_of_crlf_files(self):
+        path = core.date_to_path(fixed_now)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(Sample('08:00', 'release notes', 'dev').to_json().encode('utf-8') + b'\r\n')
+            f.write(Sample('09:00', 'jenkins release', 'dev').to_json().encode('utf-8') + b'\r\n')
+        core.rebuild_index()
+        self.storage.append(fixed_now, Sample('10:00', 'release party', 'dev'))
+        self.assertEqual([message for (_, message) in self.found('release')],
+                         ['release notes', 'jenkins release', 'release party'])
+
+    def test_logs_are_merged_into_sorted_shards(self):
+        with mock.patch.object(core, 'index_log_limit', 0):
+            self.storage.save(core.days_ago(1), [Sample('09:00', 'coding', 'dev')])
+            self.storage.append(fixed_now, Sample('13:00', 'jenkins upgrade', 'dev'))
+        shard = core.index_shard('jenkins')
+        self.assertFalse(os.path.exists(shard + '.log'))
+        with open(shard + '.idx', 'rb') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines, sorted(lines))
+        # the postings of the rewritten day were dropped
+        self.assertEqual([line for line in lines if line.startswith(b'jenkins\t')],
+                         [b'jenkins\t' + str(core.date_key(fixed_now)).encode() + b'\t0\t0'])
+        self.assertEqual(self.found('jenkins'), [('2026/10/14', 'jenkins upgrade')])
+
+    def test_bisection_stops_at_the_token(self):
+        day = [Sample(540 + i, 'abc{} abc abc-d'.format(i), 'dev') for i in range(20)]
+        self.storage.save(fixed_now, day)
+        core.rebuild_index()
+        self.assertEqual(len(core.shard_postings('abc')), 20)
+        self.assertEqual(len(core.shard_postings('abc-d')), 20)
+        self.assertEqual(len(core.shard_postings('abc7')), 1)
+        self.assertEqual(core.shard_postings('ab'), [])
@@ -0,0 +1,184 @@
+import os
+import socket
+from unittest import mock
+
+from timlib import core
+
+from fake_jira import FakeJira
+from helpers import DataDirTest
+
+
+class JiraTest(DataDirTest):
+    """Runs against a FakeJira with credentials saved in the data directory, backoff sleeps are recorded instead of
+    slept """
+
+    def setUp(self):
+        super().setUp()
+        self.jira = FakeJira()
+        with open(self.root + '/jira', 'w') as f:
+            f.write('{}\nuser\nsecret\nPRJ'.format(self.jira.url))
+        self.sleeps = []
+        sleep = mock.patch('time.sleep', self.sleeps.append)
+        sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def tearDown(self):
+        self.jira.close()
+        super().tearDown()
+
+    def rest_url(self, path: str) -> str:
+        return core.jira_base_url(self.jira.url) + path
+
+    def issue_day(self, days: int = 0):
+        self.log_day(days, [('09:00', '#PRJ-1 coding', None), ('10:30', '#2 review', None)], '11:00')
+
+
+class RetryTest(JiraTest):
+
+    def setUp(self):
+        super().setUp()
+        self.assertTrue(core.jira_connect())
+        del self.jira.requests[:]
+
+    def test_get_is_retried_with_backoff(self):
+        self.jira.replies = [(503, {}), (502, {})]
+        response = core.jira_request('GET', self.rest_url('api/2/myself'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.jira.requests), 3)
+        self.assertEqual(self.sleeps, [core.jira_backoff, core.jira_backoff * 2])
+
+    def test_retries_are_bounded(self):
+        self.jira.replies = [(503, {})] * (core.jira_retries + 2)
+        response = core.jira_request('GET', self.rest_url('api/2/myself'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.jira.requests), core.jira_retries + 1)
+
+    def test_post_is_not_retried_on_server_errors(self):
+        self.jira.replies = [(502, {})]
+        response = core.jira_request('POST', self.rest_url('api/2/issue/PRJ-1/worklog'), json={})
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(len(self.jira.requests), 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_post_is_retried_on_429_after_retry_after(self):
+        self.jira.replies = [(429, {'Retry-After': '7'})]
+        response = core.jira_request('POST', self.rest_url('api/2/issue/PRJ-1/worklog'), json={})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.jira.worklogs), 1)
+        self.assertEqual(self.sleeps, [7])
+
+    def test_post_is_retried_when_the_connection_is_refused(self):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        with self.assertRaises(IOError):
+            core.jira_request('POST', 'http://127.0.0.1:{}/rest/api/2/issue/PRJ-1/worklog'.format(port), json={})
+        self.assertEqual(len(self.sleeps), core.jira_retries)
+
+    def test_post_is_not_retried_after_a_read_timeout(self):
+        self.jira.delay = 0.5
+        with mock.patch.object(core, 'jira_timeout', (5, 0.1)), self.assertRaises(IOError):
+            core.jira_request('POST', self.rest_url('api/2/issue/PRJ-1/worklog'), json={})
+        self.assertEqual(len(self.jira.requests), 1)
+
+
+class OutboxTest(JiraTest):
+
+    def test_unsent_worklogs_are_replayed_by_the_next_sync(self):
+        self.issue_day()
+        # Jira is still busy after every retry of both posts
+        self.jira.replies = [(429, {})] * (2 * (core.jira_retries + 1))
+        counts = core.sync_jira(0, 0, lambda sample: True)
+        self.assertEqual(counts['queued'], 2)
+        self.assertEqual(self.jira.worklogs, [])
+        self.assertTrue(os.path.exists(self.root + '/jira_outbox'))
+
+        counts = core.sync_jira(0, 0, lambda sample: True)
+        self.assertEqual(counts, {'synced': 0, 'refused': 0, 'skipped': 0, 'queued': 0, 'uncertain': 0})
+        self.assertEqual(sorted(key for (key, _) in self.jira.worklogs), ['PRJ-1', 'PRJ-2'])
+        self.assertFalse(os.path.exists(self.root + '/jira_outbox'))
+        day = core.get_storage().load(core.days_ago(0))
+        self.assertEqual([sample.jira_sync for sample in day[:2]], [True, True])
+
+    def test_timed_out_worklogs_are_not_sent_again(self):
+        self.issue_day()
+        self.assertTrue(core.jira_connect())
+        self.jira.delay = 0.5
+        with mock.patch.object(core, 'jira_timeout', (5, 0.1)):
+            counts = core.sync_jira(0, 0, lambda sample: True)
+        self.assertEqual((counts['uncertain'], counts['queued']), (2, 0))
+        self.jira.delay = 0
+        counts = core.sync_jira(0, 0, lambda sample: True)
+        self.assertEqual(counts, {'synced': 0, 'refused': 0, 'skipped': 0, 'queued': 0, 'uncertain': 0})
+        self.assertEqual(len(self.jira.worklogs), 2)
+
+    def test_server_errors_are_not_sent_again(self):
+        self.issue_day()
+        self.jira.replies = [(503, {}), (503, {})]
+        counts = core.sync_jira(0, 0, lambda sample: True)
+        self.assertEqual((counts['uncertain'], counts['queued']), (2, 0))
+        core.sync_jira(0, 0, lambda sample: True)
+        self.assertEqual(len([path for (_, path, _) in self.jira.requests if path.endswith('/worklog')]), 2)
+
+    def test_uncertain_worklogs_are_resolved_by_the_user(self):
+        self.issue_day()
+        self.jira.replies = [(502, {}), (502, {})]
+        core.sync_jira(0, 0, lambda sample: True)
+        interactive = core.Context(self.root, self.context.clock, self.messages.append, True)
+        with core.using(interactive), mock.patch.object(core, 'get_yes_no',
+                                                         lambda question: 'PRJ-1' in question):
+            counts = core.sync_jira(0, 0, lambda sample: True)
+        self.assertEqual(counts['uncertain'], 0)
+        self.assertEqual([key for (key, _) in self.jira.worklogs], ['PRJ-2'])
+        self.assertFalse(os.path.exists(self.root + '/jira_outbox'))
+        day = core.get_storage().load(core.days_ago(0))
+        self.assertEqual([sample.jira_sync for sample in day[:2]], [True, True])
+
+    def test_refused_worklogs_are_not_queued(self):
+        self.issue_day()
+        self.jira.replies = [(400, {})]
+        counts = core.sync_jira(0, 0, lambda sample: True)
+        self.assertEqual((counts['synced'], counts['refused'], counts['queued']), (1, 1, 0))
+        self.assertFalse(os.path.exists(self.root + '/jira_outbox'))
+
+
+class SessionTest(JiraTest):
+
+    def test_cached_session_is_reused(self):
+        self.assertTrue(core.jira_connect())
+        self.assertEqual(self.jira.logins, 1)
+        self.assertTrue(os.path.exists(core.jira_session_path()))
+        # a later run starts with an empty context, like a new t -j
+        with core.using(core.Context(self.root, self.context.clock, self.messages.append, False)):
+            self.issue_day()
+            counts = core.sync_jira(0, 0, lambda sample: True)
+        self.assertEqual(counts['synced'], 2)
+        self.assertEqual(self.jira.logins, 1)
+        posts = [session for (method, path, session) in self.jira.requests if path.endswith('/worklog')]
+        self.assertEqual(posts, ['s1', 's1'])
+
+    def test_expired_session_logs_in_once(self):
+        self.assertTrue(core.jira_connect())
+        self.jira.expire_sessions()
+        self.log_day(0, [('0{}:00'.format(hour), '#PRJ-{} work'.format(hour), None) for hour in range(1, 9)], '09:00')
+        counts = core.sync_jira(0, 0, lambda sample: True)
+        self.assertEqual(counts['synced'], 8)
+        self.assertEqual(self.jira.logins, 2)
+        self.assertEqual(len(self.jira.worklogs), 8)
+
+    def test_workers_share_one_connection_pool(self):
+        self.assertTrue(core.jira_connect())
+        session = core.jira_session()
+        self.log_day(0, [('0{}:00'.format(hour), '#PRJ-{} work'.format(hour), None) for hour in range(1, 9)], '09:00')
+        core.sync_jira(0, 0, lambda sample: True)
+        self.assertIs(core.jira_session(), session)
+        self.assertEqual(session.get_adapter(self.jira.url)._pool_maxsize, core.jira_workers)
+
+    def test_logout_clears_the_cached_session(self):
+        self.assertTrue(core.jira_connect())
+        self.assertTrue(os.path.exists(core.jira_session_path()))
+        core.clear_jira_session()
+        self.assertFalse(os.path.exists(core.jira_session_path()))
+        self.assertEqual(len(core.jira_session().cookies), 0)
+        self.assertTrue(core.jira_connect())
+        self.assertEqual(self.jira.logins, 2)
@@ -0,0 +1,75 @@
+import os
+from unittest import mock
+
+from timlib import core
+from timlib.core import Sample
+
+from helpers import DataDirTest
+
+
+class AppendRecordTest(DataDirTest):
+    """Appends to binary day files write the new record without decoding the day """
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.root, 'day')
+        self.samples = [Sample(540 + i, '#PRJ-{} task'.format(i % 3), 'dev' if i % 2 else None) for i in range(50)]
+        self.samples.append(Sample(1020, None, None, 'END'))
+        self.samples[3].jira_sync = True
+
+    def test_appends_round_trip(self):
+        offsets = [core.append_record(self.path, sample) for sample in self.samples]
+        self.assertEqual([s.to_json() for s in core.load_file(self.path)], [s.to_json() for s in self.samples])
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertTrue(all(data[offset:offset + 1] == b'R' for offset in offsets))
+
+    def test_appends_do_not_decode_the_day(self):
+        core.append_record(self.path, self.samples[0])
+        with mock.patch.object(core, 'decode_records', side_effect=AssertionError):
+            for sample in self.samples[1:]:
+                core.append_record(self.path, sample)
+        self.assertEqual(len(core.load_file(self.path)), len(self.samples))
+
+    def test_strings_are_written_again_after_a_rewrite(self):
+        core.append_record(self.path, self.samples[0])
+        core.save_file(core.load_file(self.path), self.path, True)
+        core.append_record(self.path, self.samples[3])
+        self.assertEqual([s.to_json() for s in core.load_file(self.path)],
+                         [s.to_json() for s in (self.samples[0], self.samples[3])])
+
+    def test_refuses_json_file(self):
+        core.save_file(self.samples[:2], self.path, False)
+        with self.assertRaises(ValueError):
+            core.append_record(self.path, self.samples[2])
+
+
+class LoadLastTest(DataDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.root, 'day')
+
+    def test_last_record_read_from_the_end(self):
+        samples = [Sample(540 + i, 'task {}'.format(i % 4), 'dev', jira_skip=i == 29) for i in range(30)]
+        for sample in samples:
+            core.append_record(self.path, sample)
+        with mock.patch.object(core, 'load_file', side_effect=AssertionError):
+            self.assertEqual([s.to_json() for s in core.load_last(self.path)], [samples[-1].to_json()])
+
+    def test_same_as_json_files(self):
+        samples = [Sample(540, 'coding', 'dev'), Sample(600, None, None, 'END')]
+        json_path = os.path.join(self.root, 'json')
+        core.save_file(samples, self.path, True)
+        core.save_file(samples, json_path, False)
+        for count in (1, 2, 5):
+            self.assertEqual([s.to_json() for s in core.load_last(self.path, count)],
+                             [s.to_json() for s in core.load_last(json_path, count)])
+
+    def test_empty_and_cut_short_files(self):
+        core.save_file([], self.path, True)
+        self.assertEqual(core.load_last(self.path), [])
+        core.append_record(self.path, Sample(540, 'coding', 'dev'))
+        with open(self.path, 'ab') as f:
+            f.write(b'R\x00')
+        self.assertEqual([s.to_json() for s in core.load_last(self.path)], [Sample(540, 'coding', 'dev').to_json()])
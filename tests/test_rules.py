@@ -0,0 +1,42 @@
+import unittest
+
+from timlib.core import TagRules
+
+
+class TagRulesTest(unittest.TestCase):
+
+    def test_first_matching_rule_wins(self):
+        rules = TagRules([('dev', '^#PRJ-'), ('meet', 'standup|meeting'), ('ops', 'deploy')])
+        self.assertIsNotNone(rules.matcher)
+        self.assertEqual(rules.suggest('#PRJ-1 standup notes'), 'dev')
+        self.assertEqual(rules.suggest('Daily STANDUP'), 'meet')
+        self.assertEqual(rules.suggest('lunch'), None)
+
+    def test_both_modes_match_after_a_newline(self):
+        combined = TagRules([('meet', 'standup')])
+        one_by_one = TagRules([('meet', 'standup'), ('dev', r'(\w+) \1')])
+        self.assertIsNotNone(combined.matcher)
+        self.assertIsNone(one_by_one.matcher)
+        for rules in (combined, one_by_one):
+            self.assertEqual(rules.suggest('notes\nstandup'), 'meet')
+            self.assertEqual(rules.suggest('notes\nlunch'), None)
+
+    def test_numbered_backreferences(self):
+        rules = TagRules([('dev', '(alpha|beta) build'), ('meet', r'(\w+) \1')])
+        self.assertEqual(rules.suggest('bye bye'), 'meet')
+        self.assertEqual(rules.suggest('beta build'), 'dev')
+        self.assertEqual(rules.suggest('bye now'), None)
+
+    def test_escaped_backslash_is_not_a_backreference(self):
+        rules = TagRules([('dev', r'(a)\\1')])
+        self.assertIsNotNone(rules.matcher)
+        self.assertEqual(rules.suggest('a\\1'), 'dev')
+
+    def test_inline_global_flags(self):
+        rules = TagRules([('dev', 'code'), ('meet', '(?s)stand.up')])
+        self.assertEqual(rules.suggest('stand\nup'), 'meet')
+        self.assertEqual(rules.suggest('Code review'), 'dev')
+
+    def test_repeated_group_names(self):
+        rules = TagRules([('dev', '(?P<key>PRJ)-1'), ('ops', '(?P<key>OPS)-')])
+        self.assertEqual(rules.suggest('#OPS-2 restart'), 'ops')
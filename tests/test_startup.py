@@ -0,0 +1,49 @@
+"""Startup overhead of the command line, the budget of bench.py --check with room for slow machines """
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import bench
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# bench.py --check holds the real budget, a test run only catches imports that make startup several times slower
+slack = 5
+
+
+def best_time(command: [str], env: dict, repeat: int = 5) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class StartupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.TemporaryDirectory()
+        self.env = dict(os.environ, HOME=self.home.name)
+        self.script = os.path.join(root_dir, 'tim.py')
+        self.interpreter = best_time([sys.executable, '-c', 'pass'], self.env)
+
+    def tearDown(self):
+        self.home.cleanup()
+
+    def test_help_within_budget(self):
+        elapsed = best_time([sys.executable, self.script, '--help'], self.env)
+        self.assertLess((elapsed - self.interpreter) * 1000, bench.startup_budget_ms * slack)
+
+    def test_append_within_budget(self):
+        elapsed = best_time([sys.executable, self.script, 'startup', 'test'], self.env)
+        self.assertLess((elapsed - self.interpreter) * 1000, bench.startup_budget_ms * slack)
+
+
+if __name__ == '__main__':
+    unittest.main()
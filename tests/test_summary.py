@@ -0,0 +1,117 @@
+import io
+import os
+import shutil
+from contextlib import redirect_stdout
+from unittest import mock
+
+from timlib import core
+
+from helpers import DataDirTest
+
+
+class SummaryTableTest(DataDirTest):
+
+    def summary_output(self, *args) -> str:
+        output = io.StringIO()
+        with redirect_stdout(output):
+            core.summarize(*args)
+        return output.getvalue()
+
+    def test_batch_table_of_untagged_day(self):
+        core.add_tag('dev')
+        self.log_day(0, [('09:00', '#PRJ-1 untagged work', None), ('10:00', 'coding', 'dev'),
+                         ('11:00', 'more coding', 'dev')], '12:00')
+        output = self.summary_output(0, 0, True, 'table')
+        self.assertIn(core.untagged_label, output)
+        self.assertIn('#PRJ-1 untagged work', output)
+
+
+class EngineParityTest(DataDirTest):
+    """The python, numpy and sqlite engines give the same summary """
+
+    def setUp(self):
+        super().setUp()
+        for tag in ('dev', 'meet'):
+            core.add_tag(tag)
+        # a break ended mid-day and work resumed after it
+        self.log_day(0, [('09:00', '#PRJ-1 coding', 'dev'), ('10:00', 'more coding', 'dev'),
+                         ('11:00', 'standup', 'meet'), ('11:15', None, None), ('13:00', '#PRJ-2 review', 'dev'),
+                         ('14:00', 'untagged', None)], '17:00')
+        self.log_day(1, [('08:30', 'untagged', None), ('09:00', '#PRJ-1 coding', 'dev'), ('12:00', 'sync', 'meet')],
+                     '12:30')
+        self.log_day(2, [('10:00', 'still running', 'dev')])
+        self.log_day(3, [('09:00', '#PRJ-3 open', 'dev'), ('10:00', '#PRJ-3 open', 'dev')])
+
+    def log_day(self, days: int, samples: [(str, str, str)], end: str = None):
+        day = [core.Sample(time, None, None, 'END') if message is None else core.Sample(time, message, tag)
+               for (time, message, tag) in samples]
+        if end is not None:
+            day.append(core.Sample(end, None, None, 'END'))
+        core.get_storage().save(core.days_ago(days), day)
+
+    def file_summary(self) -> dict:
+        return core.summary_dict(core.FileStorage().summarize(0, 6, None, 1), 0, 6)
+
+    def test_python_and_numpy_days(self):
+        import numpy
+        paths = [core.date_to_path(core.days_ago(days)) for days in range(4)]
+        python_days = [core.day_cache_entry(path)['summary'] for path in paths]
+        numpy_days = [entry['summary'] for entry in core.numpy_day_cache_entries(paths, numpy)]
+        self.assertEqual(python_days, numpy_days)
+
+    def test_python_numpy_and_sqlite_summaries(self):
+        saved_engine = os.environ.get('TIM_ENGINE')
+        try:
+            os.environ['TIM_ENGINE'] = 'python'
+            python_summary = self.file_summary()
+            shutil.rmtree(self.root + '/cache', ignore_errors=True)
+            os.environ['TIM_ENGINE'] = 'numpy'
+            with mock.patch.object(core, 'numpy_day_cache_entries', wraps=core.numpy_day_cache_entries) as engine:
+                numpy_summary = self.file_summary()
+            self.assertEqual(engine.call_count, 1)
+        finally:
+            os.environ.pop('TIM_ENGINE')
+            if saved_engine is not None:
+                os.environ['TIM_ENGINE'] = saved_engine
+        sqlite = core.SqliteStorage()
+        for date in core.FileStorage().dates():
+            sqlite.save(date, core.FileStorage().load(date))
+        sqlite_summary = core.summary_dict(sqlite.summarize(0, 6, None, 1), 0, 6)
+        self.assertEqual(python_summary, numpy_summary)
+        self.assertEqual(python_summary, sqlite_summary)
+
+    def test_engine_is_chosen_per_range(self):
+        with mock.patch.dict(os.environ), mock.patch.object(core, 'numpy_min_days', 100):
+            os.environ.pop('TIM_ENGINE', None)
+            self.assertFalse(core.uses_numpy(99))
+            self.assertTrue(core.uses_numpy(100))
+            os.environ['TIM_ENGINE'] = 'python'
+            self.assertFalse(core.uses_numpy(1000))
+            os.environ['TIM_ENGINE'] = 'numpy'
+            self.assertTrue(core.uses_numpy(1))
+        with mock.patch.object(core, 'numpy_day_cache_entries', return_value=[]) as engine:
+            core.day_cache_entries([], True)
+            core.day_cache_entries([], False)
+        self.assertEqual(engine.call_count, 1)
+
+
+class ExportTest(DataDirTest):
+
+    def test_issue_is_the_jira_key(self):
+        core.add_tag('dev')
+        with open(self.root + '/jira', 'w') as f:
+            f.write('jira.example.com\nuser\nsecret\nPRJ\n')
+        self.log_day(0, [('09:00', '#PRJ-1 coding', 'dev'), ('10:00', '#PRJ-1 review', 'dev'),
+                         ('11:00', 'meeting', None), ('11:30', '#7 coding', 'dev')], '13:00')
+        rows = [dict(zip(core.export_fields, row)) for row in core.export_rows(0, 0)]
+        self.assertEqual([row['issue'] for row in rows], ['PRJ-1', 'PRJ-1', None, 'PRJ-7'])
+        with core.using(core.Context(self.root, self.context.clock, self.messages.append, False)):
+            core.context().jira_config['prefix'] = 'PRJ'
+            worklogs = [core.jira_worklog(core.days_ago(0), core.Sample(*row), core.Sample('13:00', None, None, 'END'),
+                                         '+0000')[0]
+                        for row in (('09:00', '#PRJ-1 coding'), ('11:30', '#7 coding'))]
+        self.assertEqual(worklogs, ['PRJ-1', 'PRJ-7'])
+
+    def test_bare_numbers_without_saved_prefix(self):
+        self.log_day(0, [('09:00', '#7 coding', None)], '10:00')
+        self.assertEqual([row[5] for row in core.export_rows(0, 0)], ['7'])
@@ -0,0 +1,70 @@
+import functools
+import io
+import json
+import multiprocessing
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+from unittest import mock
+
+from timlib import core
+
+from helpers import DataDirTest
+
+
+class TeamSummaryTest(DataDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.members = []
+        for user in ('alice', 'bob', 'carol'):
+            root = os.path.join(self.root, user)
+            os.makedirs(root)
+            with core.using(core.Context(root, self.context.clock)):
+                core.add_tag('dev')
+                core.get_storage().save(core.days_ago(0), [core.Sample('09:00', 'coding', 'dev'),
+                                                           core.Sample('11:00', None, None, 'END')])
+            self.members.append(root)
+
+    def team_json(self, jobs: int = 1) -> (dict, str):
+        (output, errors) = (io.StringIO(), io.StringIO())
+        with redirect_stdout(output), redirect_stderr(errors):
+            core.team_summary(0, 0, self.members, 'json', jobs)
+        return json.loads(output.getvalue()), errors.getvalue()
+
+    def test_malformed_day_fails_one_member(self):
+        with open(core.date_to_path(core.days_ago(0)).replace(self.root, self.members[1]), 'a') as f:
+            f.write('[1, 2]\n')
+        (report, errors) = self.team_json()
+        self.assertEqual([user['user'] for user in report['users']], ['alice', 'carol'])
+        self.assertEqual([user['user'] for user in report['failed']], ['bob'])
+        self.assertEqual(report['work_days'], 2)
+        self.assertIn('Failed to summarize bob', errors)
+
+    def test_any_error_fails_one_member(self):
+        summary = core.root_summary
+
+        def root_summary(root, first, last, now):
+            if root.endswith('alice'):
+                raise sqlite3.DatabaseError('file is not a database')
+            return summary(root, first, last, now)
+        with mock.patch.object(core, 'root_summary', root_summary):
+            (report, errors) = self.team_json()
+        self.assertEqual([user['user'] for user in report['users']], ['bob', 'carol'])
+        self.assertIn('DatabaseError: file is not a database', errors)
+
+    def test_workers_use_the_clock_of_the_caller(self):
+        spawn = functools.partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context('spawn'))
+        with mock.patch('concurrent.futures.ProcessPoolExecutor', spawn):
+            (report, errors) = self.team_json(2)
+        self.assertEqual(errors, '')
+        self.assertEqual(report['work_days'], 3)
+        self.assertEqual(report, self.team_json(1)[0])
+
+    def test_table_lists_failed_members(self):
+        with mock.patch.object(core, 'root_summary', side_effect=AttributeError('broken')):
+            output = io.StringIO()
+            with redirect_stdout(output), redirect_stderr(io.StringIO()):
+                core.team_summary(0, 0, self.members[:1], 'table', 1)
+        self.assertRegex(output.getvalue(), r'alice\s+\|\s+failed')
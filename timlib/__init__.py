@@ -0,0 +1,14 @@
+"""tim the time tracker as a package. timlib.core is the engine, timlib.cli the command line (tim.py) and
+timlib.api the Tim class for using a data directory in process """
+
+from timlib.core import Sample, Summary, TagStore
+
+__all__ = ['Tim', 'Sample', 'Summary', 'TagStore']
+
+
+def __getattr__(name):
+    # the API (and logging) is only imported by its users, the command line starts without it
+    if name == 'Tim':
+        from timlib.api import Tim
+        return Tim
+    raise AttributeError("module 'timlib' has no attribute '{}'".format(name))
@@ -0,0 +1,93 @@
+"""In-process API of tim, for tools that log or report without running the tim command:
+
+    from timlib import Tim
+    t = Tim('/path/to/data')
+    t.insert('#PRJ-12 reviewing', tag='dev')
+    report = t.summarize(0, 6)
+"""
+
+import logging
+import os
+from datetime import datetime
+
+from timlib import core
+from timlib.core import Sample
+
+log = logging.getLogger('timlib')
+
+
+class Tim(object):
+    """A tim data directory (~/.config/tim by default) with its own clock. Every call runs the engine in the context
+    of this instance, which keeps its storage and Jira session between calls. Messages of the engine go to the timlib
+    logger and nothing prompts. Instances don't share state, but one instance is not meant to be used from several
+    threads at once """
+
+    def __init__(self, data_dir: str = None, clock=datetime.now):
+        data_dir = core.data_dir() if data_dir is None else os.path.expanduser(data_dir)
+        self.context = core.Context(data_dir, clock, log.info, False)
+
+    @property
+    def data_dir(self) -> str:
+        return self.context.tim_dir
+
+    def insert(self, message: str, tag: str = None, at: datetime = None) -> Sample:
+        """Starts an activity at the given time, now by default """
+        with core.using(self.context):
+            at = core.current_time() if at is None else at
+            sample = Sample(at.hour * 60 + at.minute, message, tag)
+            core.get_storage().append(at, sample)
+            return sample
+
+    def end(self, at: datetime = None) -> Sample:
+        """Ends the day of the given time, now by default """
+        with core.using(self.context):
+            at = core.current_time() if at is None else at
+            sample = Sample(at.hour * 60 + at.minute, None, None, 'END')
+            core.get_storage().append(at, sample)
+            return sample
+
+    def load(self, day=0) -> [Sample]:
+        """The samples of a day, given as a date or as a number of days ago """
+        with core.using(self.context):
+            return core.get_storage().load(core.days_ago(day) if isinstance(day, int) else day)
+
+    def save(self, day, samples: [Sample]):
+        with core.using(self.context):
+            core.get_storage().save(core.days_ago(day) if isinstance(day, int) else day, samples)
+
+    def summarize(self, start: int, end: int, jobs: int = 1) -> dict:
+        """Summary of the days from <start> days ago until <end> days ago, in the structure of t -s --format json.
+        Untagged days are not reviewed """
+        (start, end) = (min(start, end), max(start, end))
+        with core.using(self.context):
+            summary = core.get_storage().summarize(start, end, None, jobs)
+            return core.summary_dict(summary, start, end)
+
+    def tags(self) -> [str]:
+        with core.using(self.context):
+            return list(core.load_tags())
+
+    def add_tag(self, tag: str) -> bool:
+        """Defines a tag, False when it was already defined """
+        with core.using(self.context):
+            return core.add_tag(tag)
+
+    def find(self, *terms: str) -> [(datetime, Sample, int)]:
+        """(date, sample, duration in minutes) of the activities having all the terms, like t --find """
+        with core.using(self.context):
+            return core.find_matches(core.query_tokens(terms))
+
+    def sync_jira(self, start: int, end: int = None, confirm=None) -> dict:
+        """Sends the worklogs of the issues from <start> days ago until <end> days ago to Jira, using the saved
+        credentials (t -j asks for them once). confirm(sample) chooses the issues to send, all of them by default.
+        Returns the number of synced, refused, skipped, queued and uncertain worklogs. Uncertain ones may already be in
+        Jira, they stay in the outbox until an interactive t -j asks about them """
+        with core.using(self.context):
+            if not os.path.exists(core.data_dir() + 'jira'):
+                raise RuntimeError("No saved Jira credentials in {}".format(core.data_dir()))
+            end = start if end is None else end
+            confirm = (lambda sample: True) if confirm is None else confirm
+            counts = core.sync_jira(min(start, end), max(start, end), confirm)
+            if counts is None:
+                raise RuntimeError("Could not log in to Jira with the credentials saved in {}".format(core.data_dir()))
+            return counts
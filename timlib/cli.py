@@ -0,0 +1,536 @@
+"""Command line of tim: argument parsing, help and the daemon serving commands over a unix socket """
+
+import os
+import sys
+import json
+import time
+from datetime import datetime
+
+from timlib import core
+from timlib.core import (FileStorage, Sample, SummaryCache, add_tag, add_trace_time, autotag, cat, clear_jira_session,
+                         convert_days, data_formats, date_key, date_to_path, days_ago, export, export_formats, find,
+                         get_storage, import_events, insert, insert_command, load_tags, migrate_storage, print_status,
+                         print_trace, rebuild_index, review, storages, summarize, summary_formats, sync_jira,
+                         team_summary, trace_phase, ver, watch, watch_interval)
+
+
+# ------ Daemon
+
+daemon_cached_days = 8
+# seconds a client waits for the daemon before running the command itself
+daemon_timeout = 30
+
+
+def daemon_socket_path() -> str:
+    return core.data_dir() + "tim.sock"
+
+
+class DaemonStorage(object):
+    """Storage used by the daemon. It keeps the samples of recently used days in memory for as long as their day
+    file is unchanged, every write still goes to the wrapped storage so the editor and runs without the daemon see
+    the same data """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.name = storage.name
+        self.days = {}
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def stat(self, date: datetime):
+        if not isinstance(self.storage, FileStorage):
+            return None
+        try:
+            st = os.stat(date_to_path(date))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def load(self, date: datetime) -> [Sample]:
+        key = date_key(date)
+        st = self.stat(date)
+        cached = self.days.get(key)
+        if cached is None or st is None or cached[0] != st:
+            samples = self.storage.load(date)
+            self.days.pop(key, None)
+            if st is not None:
+                self.days[key] = (st, samples)
+                if len(self.days) > daemon_cached_days:
+                    del self.days[next(iter(self.days))]
+            return list(samples)
+        return list(cached[1])
+
+    def last(self, date: datetime, count: int = 1) -> [Sample]:
+        return self.load(date)[-count:]
+
+    def append(self, date: datetime, sample: Sample):
+        key = date_key(date)
+        cached = self.days.pop(key, None)
+        valid = cached is not None and cached[0] == self.stat(date)
+        self.storage.append(date, sample)
+        st = self.stat(date)
+        if valid and st is not None:
+            cached[1].append(sample)
+            self.days[key] = (st, cached[1])
+
+    def save(self, date: datetime, samples: [Sample]):
+        self.days.pop(date_key(date), None)
+        self.storage.save(date, samples)
+
+
+def daemon_serves(argv: [str], batch: bool = False) -> bool:
+    """Whether the command can run on the daemon: appends, print, status, tags and non interactive summaries. With
+    batch, only summaries given --batch count as non interactive, like the daemon sees them """
+    if len(argv) == 1:
+        return True
+    first = argv[1]
+    if first == '-s' or first == '--summary':
+        return '--batch' in argv or not (batch or sys.stdin.isatty())
+    if first == '-c' or first == '--command':
+        return len(argv) == 3 and argv[2] == 'tags'
+    if first in ('-t', '-tt', '-e', '--end', '-p', '--print', '--status'):
+        return True
+    return not first.startswith('-')
+
+
+def run_on_daemon(argv: [str]) -> bool:
+    """Sends the command to a running daemon and prints its output. Returns False when no daemon answers, in which
+    case the caller runs the command itself: the daemon refused it or did not answer within daemon_timeout """
+    path = daemon_socket_path()
+    if not os.path.exists(path):
+        return False
+    import socket
+    request = list(argv)
+    if request[1:2] in (['-s'], ['--summary']) and '--batch' not in request:
+        request.append('--batch')
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(daemon_timeout)
+            client.connect(path)
+            client.sendall(json.dumps({'args': request}).encode('utf-8') + b'\n')
+            client.shutdown(socket.SHUT_WR)
+            response = b''
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+    except OSError:
+        return False
+    if response == b'':
+        return False
+    response = json.loads(response.decode('utf-8'))
+    if 'output' not in response:
+        return False
+    sys.stdout.write(response['output'])
+    return True
+
+
+def handle_daemon_request(connection):
+    import io
+    import traceback
+    from contextlib import redirect_stdout
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    request = json.loads(data.decode('utf-8'))
+    args = request.get('args') if isinstance(request, dict) else None
+    if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args) or not daemon_serves(args, True):
+        # the daemon serves one request at a time, a prompt or an endless command would block every client
+        connection.sendall(json.dumps({'error': "not served by the daemon: {}".format(args)}).encode('utf-8'))
+        return
+    output = io.StringIO()
+    stdin = sys.stdin
+    # a command that asks anything reads the end of input instead of waiting for the daemon's terminal
+    sys.stdin = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            try:
+                run(args, True)
+            except Exception:
+                traceback.print_exc(file=output)
+    finally:
+        sys.stdin = stdin
+    connection.sendall(json.dumps({'output': output.getvalue()}).encode('utf-8'))
+
+
+def serve_daemon():
+    """Runs the daemon in the foreground until it is interrupted. Requests are served one at a time on a unix socket
+    in tim_dir, with the tags, recent days and summary cache kept in memory """
+    import signal
+    import socket
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    path = daemon_socket_path()
+    if os.path.exists(path):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(path)
+            print("Tim daemon is already running.")
+            return
+        except OSError:
+            os.remove(path)
+    os.makedirs(core.data_dir(), exist_ok=True)
+    storage = get_storage()
+    if isinstance(storage, FileStorage):
+        storage.summary_cache = SummaryCache()
+    core.context().storage = DaemonStorage(storage)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # the socket is created private, a chmod after bind would leave a window where anyone can connect
+    umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    print("Tim daemon listening on {}".format(path))
+    try:
+        while True:
+            (connection, _) = server.accept()
+            with connection:
+                connection.settimeout(daemon_timeout)
+                try:
+                    handle_daemon_request(connection)
+                except (OSError, ValueError) as e:
+                    print("WARNING: bad request: {}".format(e))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(path)
+
+
+def print_help():
+    print("Tim time tracker, version {}".format(ver))
+    print("---------------------------------\n")
+    commands = [
+        ("-t <MINUTES> <MESSAGE>", "Start activity from <MINUTES> ago"),
+        ("<MESSAGE>", "start activity from this moment"),
+        ("-tt <MINUTES> <MESSAGE>",
+         "Start and finish given activity from <MINUTES> ago, then continue the last activity."),
+        ("-o, --open [DAYS_AGO]", "Open log file for specified day in default system editor. default value is 0."),
+        ("-s, --summary <START> [END] [--batch] [--format table|json|csv] [--jobs N]",
+         "Summarize events from <START> days ago until <END> days ago, inclusive. --batch skips the review of "
+         "untagged days (implied when stdin is not a terminal), --format selects the output format, --jobs sets the "
+         "number of processes used to read long ranges (default TIM_JOBS or the number of cpus)."),
+        ("-j, --jira [DAY_AGO] [END]",
+         "Sync issues of the given day (or of the days from DAY_AGO until END days ago) with jira, an issue is a "
+         "message that starts with #, default value is 0. Worklogs that can't reach jira are queued and sent by "
+         "the next sync"),
+        ("-r, --review [DAYS_AGO]", "review and add tags to activities. Default value is 0"),
+        ("-p, --print [DAYS_AGO]", "Print data file, default value is 0"),
+        ("--status", "Print the current activity and how long it has been going on"),
+        ("--find <TERMS>", "Print the activities having all the words, issues or tag:NAME terms, with their durations"),
+        ("--find --rebuild", "Rebuild the search index, after editing day files by hand"),
+        ("--watch [SECONDS]", "Keep showing the current activity and today's tag totals, refreshed every SECONDS "
+                              "(default 5)"),
+        ("--team <START> <END> <DIR>... [--format table|json|csv] [--jobs N]",
+         "Summarize the data directories (or home directories) of a team, with totals per user and for the team"),
+        ("--export <START> <END> [--format csv|jsonl] [--output FILE]",
+         "Write every activity from <START> days ago until <END> days ago with its duration, tag and issue, oldest "
+         "first, to stdout or FILE"),
+        ("--import [FILE] [--format csv|jsonl]",
+         "Add the events of FILE (or stdin) to their days in time order, events have a date and time (or a "
+         "timestamp), a message and optionally a tag. csv is assumed for *.csv files, jsonl otherwise"),
+        ("--autotag <START> <END>", "Tag the untagged activities from <START> days ago until <END> days ago with the "
+                                    "rules in ~/.config/tim/rules"),
+        ("--daemon", "Run the tim daemon in the foreground, while it runs t commands are served by it"),
+        ("-e, --end", "Ends current day."),
+        ("-c, --command tags", "list tags"),
+        ("-c, --command add <TAG>", "add a tag, unless it is already defined."),
+        ("-c, --command end", "Add end to the file"),
+        ("-c, --command logout", "Forget the cached Jira session, the next Jira command logs in again"),
+        ("-c, --command storage", "Print the storage backend in use (file or sqlite)"),
+        ("-c, --command migrate <STORAGE>",
+         "Copy all data into the given storage (file or sqlite) and switch to it"),
+        ("-c, --command convert <FORMAT>",
+         "Rewrite all day files as json or binary records, new days are then written in that format"),
+        ("--profile[=FILE] <COMMAND>",
+         "Run the command and print per phase timings and I/O counters, FILE (*.prof) receives a cProfile dump. "
+         "Setting TIM_TRACE does the same"),
+        ("-h, --help", "print this help"),
+    ]
+    for command in commands:
+        print("" + command[0])
+        print("\t" + command[1])
+        print()
+
+
+def parse_options(arguments: [str], known: dict) -> ([str], dict):
+    """Separates --options from positional arguments. known maps every accepted option to whether it takes a value.
+    Returns (None, None) after printing an error for unknown or incomplete options """
+    params = []
+    options = {}
+    i = 0
+    while i < len(arguments):
+        arg = arguments[i]
+        if arg.startswith('--'):
+            if arg not in known:
+                print("Unknown option {}".format(arg))
+                return None, None
+            if known[arg]:
+                if i + 1 >= len(arguments):
+                    print("Expected a value after {}".format(arg))
+                    return None, None
+                i += 1
+                options[arg] = arguments[i]
+            else:
+                options[arg] = True
+        else:
+            params.append(arg)
+        i += 1
+    return params, options
+
+
+def run(args: [str], in_daemon: bool = False):
+    """Runs the command of argv <args>, handing it to a running daemon when it can serve it """
+    if not in_daemon and daemon_serves(args) and run_on_daemon(args):
+        return
+    now = core.current_time()
+    if len(args) == 1:
+        cat(now)
+        print("")
+    else:
+        first = args[1]
+        if first == '-j' or first == '--jira':
+            start = 0
+            end = 0
+            if len(args) == 3:
+                start = end = int(args[2])
+            elif len(args) == 4:
+                start = int(args[2])
+                end = int(args[3])
+                if start > end:
+                    (start, end) = (end, start)
+            elif len(args) > 4:
+                print('Expected at most two numerical arguments')
+                return
+            sync_jira(start, end)
+
+        elif first == "--summary" or first == '-s':
+            (params, options) = parse_options(args[2:], {'--batch': False, '--format': True, '--jobs': True})
+            if params is None:
+                return
+            jobs = int(options['--jobs']) if '--jobs' in options else None
+            output_format = options.get('--format', 'table')
+            if output_format not in summary_formats:
+                print('Expected one of {} as format'.format(", ".join(summary_formats)))
+                return
+            batch = '--batch' in options or not sys.stdin.isatty()
+            if len(params) == 1:
+                summarize(0, int(params[0]), batch, output_format, jobs)
+            elif len(params) == 2:
+                start = int(params[0])
+                end = int(params[1])
+                if start > end:
+                    (start, end) = (end, start)
+                summarize(start, end, batch, output_format, jobs)
+            else:
+                print('Expected at least one numerical argument')
+
+        elif first == '-r' or first == "--review":
+            days = 0
+            if len(args) == 3:
+                days = int(args[2])
+            elif len(args) > 3:
+                print('Expected one numerical argument')
+                return
+            review(days_ago(days))
+
+        elif first == '-o' or first == '--open':
+            days = 0
+            if len(args) == 3:
+                days = int(args[2])
+            elif len(args) > 3:
+                print('Expected one numerical argument')
+                return
+            get_storage().edit(days_ago(days))
+
+        elif first == '-p' or first == '--print':
+            days = 0
+            if len(args) == 3:
+                days = int(args[2])
+            elif len(args) > 3:
+                print('Expected one numerical argument')
+                return
+            cat(days_ago(days))
+
+        elif first == "--status":
+            print_status(now)
+
+        elif first == "--find":
+            if len(args) == 3 and args[2] == '--rebuild':
+                rebuild_index()
+                print("Search index rebuilt.")
+            else:
+                find(args[2:])
+
+        elif first == "--watch":
+            if len(args) > 3:
+                print('Expected one numerical argument')
+                return
+            watch(float(args[2]) if len(args) == 3 else watch_interval)
+
+        elif first == "--team":
+            (params, options) = parse_options(args[2:], {'--format': True, '--jobs': True})
+            if params is None:
+                return
+            output_format = options.get('--format', 'table')
+            if output_format not in summary_formats:
+                print('Expected one of {} as format'.format(", ".join(summary_formats)))
+                return
+            if len(params) < 3:
+                print('Expected two numerical arguments and at least one directory')
+                return
+            start = int(params[0])
+            end = int(params[1])
+            if start > end:
+                (start, end) = (end, start)
+            team_summary(start, end, params[2:], output_format, int(options['--jobs']) if '--jobs' in options else None)
+
+        elif first == "--export":
+            (params, options) = parse_options(args[2:], {'--format': True, '--output': True})
+            if params is None:
+                return
+            output_format = options.get('--format', 'csv')
+            if output_format not in export_formats:
+                print('Expected one of {} as format'.format(", ".join(export_formats)))
+                return
+            if len(params) != 2:
+                print('Expected two numerical arguments')
+                return
+            start = int(params[0])
+            end = int(params[1])
+            if start > end:
+                (start, end) = (end, start)
+            export(start, end, output_format, options.get('--output'))
+
+        elif first == "--import":
+            (params, options) = parse_options(args[2:], {'--format': True})
+            if params is None:
+                return
+            if len(params) > 1:
+                print('Expected at most one file')
+                return
+            path = params[0] if params and params[0] != '-' else None
+            input_format = options.get('--format', 'csv' if path is not None and path.endswith('.csv') else 'jsonl')
+            if input_format not in export_formats:
+                print('Expected one of {} as format'.format(", ".join(export_formats)))
+                return
+            if path is None:
+                import_events(sys.stdin, input_format)
+            else:
+                with open(path, 'r', newline='') as f:
+                    import_events(f, input_format)
+
+        elif first == "--autotag":
+            if len(args) != 4:
+                print('Expected two numerical arguments')
+                return
+            start = int(args[2])
+            end = int(args[3])
+            if start > end:
+                (start, end) = (end, start)
+            autotag(start, end)
+
+        elif first == "--daemon":
+            serve_daemon()
+
+        elif first == "-h" or first == "--help":
+            print_help()
+
+        elif first == "-e" or first == "--end":
+            insert_command("END", now, str(now.hour) + ':' + str(now.minute))
+
+        elif first == "-c" or first == '--command':
+            command = args[2]
+
+            if command == 'tags':
+                arr = load_tags()
+                print(", ".join(arr))
+            elif command == "logout":
+                clear_jira_session()
+                print("Jira session removed.")
+            elif command == "storage":
+                print(get_storage().name)
+            elif command == "migrate":
+                if len(args) == 4:
+                    migrate_storage(args[3])
+                else:
+                    print("Expected one argument after migrate: {}".format(", ".join(storages)))
+            elif command == "convert":
+                if len(args) == 4:
+                    convert_days(args[3])
+                else:
+                    print("Expected one argument after convert: {}".format(", ".join(data_formats)))
+            elif command == "add":
+                if len(args) == 4:
+                    if not add_tag(args[3]):
+                        print("{} is already defined".format(args[3].strip()))
+                    arr = load_tags()
+                    print(", ".join(arr))
+                else:
+                    print("Expected One argument after add")
+
+        elif args[1] == "-t":
+            d = int(args[2])
+            message = " ".join(args[3:])
+            insert(message, now, d)
+
+        elif args[1] == "-tt":
+            if len(args) < 4:
+                print("Invalid args: t -tt MINUTES MESSAGE")
+                return
+            time_diff = int(args[2])
+            message = " ".join(args[3:])
+            samples = get_storage().last(now)
+            insert(message, now, time_diff)
+            if len(samples) > 0:
+                target = samples[-1]
+                insert(target.message, now, 0, target.tag)
+
+        else:
+            message = " ".join(args[1:])
+            if message.startswith('-'):
+                print("ERROR: Message cannot start with '-'.")
+            else:
+                insert(message, now, 0)
+
+
+def main():
+    """Command line entry point. A leading --profile (or --profile=FILE) enables tracing like TIM_TRACE does, FILE
+    or a TIM_TRACE value ending in .prof receives a cProfile dump of the command """
+    args = sys.argv
+    profile_path = os.environ.get('TIM_TRACE', '')
+    if len(args) > 1 and (args[1] == '--profile' or args[1].startswith('--profile=')):
+        core.trace_enabled = True
+        profile_path = args[1][len('--profile='):]
+        args = args[:1] + args[2:]
+    if not core.trace_enabled:
+        run(args)
+        return
+
+    add_trace_time('imports', time.perf_counter() - core.started)
+    profiler = None
+    if profile_path.endswith('.prof'):
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with trace_phase('command'):
+            run(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        print_trace(args[1:])
+        if profiler is not None:
+            print("cProfile dump written to {}".format(profile_path), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3081 @@
+"""Engine of tim: samples and day files, storages, summaries, tags, search, import/export and Jira sync. The
+command line lives in timlib.cli and the embeddable API in timlib.api """
+
+from __future__ import annotations
+import time
+
+started = time.perf_counter()
+
+import os
+import sys
+import json
+import re
+from array import array
+from bisect import bisect_left
+from contextvars import ContextVar
+from datetime import timedelta
+from datetime import datetime
+
+# requests, readline, shutil, subprocess and dateutil are imported lazily by the commands that need them, so that the
+# append commands (<MESSAGE>, -t, -e) only pay for the interpreter and json.
+
+# ------ Configurations
+ver = "0.1.0"
+EDITOR = os.environ.get('EDITOR', 'vim')
+
+
+class Context(object):
+    """What the engine works on: the data directory, the clock, the storage opened on the directory, the Jira session
+    and where messages go. The command line runs in one context per process, every Tim of the API has its own.
+    A context that is not interactive never prompts """
+    __slots__ = ('tim_dir', 'clock', 'storage', 'jira_config', 'echo', 'interactive')
+
+    def __init__(self, tim_dir: str, clock=datetime.now, echo=print, interactive: bool = True):
+        self.tim_dir = os.path.join(tim_dir, '')
+        self.clock = clock
+        self.storage = None
+        self.jira_config = {}
+        self.echo = echo
+        self.interactive = interactive
+
+
+_context = ContextVar('tim_context', default=Context("{}/.config/tim/".format(os.path.expanduser("~"))))
+
+
+def context() -> Context:
+    return _context.get()
+
+
+def activate(ctx: Context):
+    """Makes ctx the context of the current thread from now on """
+    _context.set(ctx)
+
+
+class using(object):
+    """Context manager running its block in the given context """
+    __slots__ = ('ctx', 'token')
+
+    def __init__(self, ctx: Context):
+        self.ctx = ctx
+
+    def __enter__(self):
+        self.token = _context.set(self.ctx)
+        return self.ctx
+
+    def __exit__(self, *exc):
+        _context.reset(self.token)
+
+
+def data_dir() -> str:
+    return _context.get().tim_dir
+
+
+def current_time() -> datetime:
+    return _context.get().clock()
+
+
+def notify(message: str):
+    """Reports progress and problems of commands that the API runs too, it logs them instead of printing """
+    _context.get().echo(message)
+
+
+# ------ Tracing
+# Enabled by the TIM_TRACE environment variable or a leading --profile argument. When disabled every hook is a single
+# check of trace_enabled.
+
+trace_enabled = os.environ.get('TIM_TRACE', '') != ''
+trace_phases = {}
+trace_counters = {}
+trace_latencies = []
+
+
+class trace_phase(object):
+    """Context manager adding the wall time of its block to the given phase """
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        if trace_enabled:
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        if trace_enabled:
+            add_trace_time(self.name, time.perf_counter() - self.start)
+
+
+def add_trace_time(name: str, seconds: float):
+    phase = trace_phases.setdefault(name, [0.0, 0])
+    phase[0] += seconds
+    phase[1] += 1
+
+
+def trace_count(name: str, value: int = 1):
+    if trace_enabled:
+        trace_counters[name] = trace_counters.get(name, 0) + value
+
+
+def print_trace(command: [str]):
+    out = sys.stderr
+    print("\n---- tim trace: {}".format(" ".join(command)), file=out)
+    print("{:<12s} {:>10s} {:>7s}".format("phase", "total(ms)", "calls"), file=out)
+    for (name, (seconds, calls)) in trace_phases.items():
+        print("{:<12s} {:>10.2f} {:>7d}".format(name, seconds * 1000, calls), file=out)
+    for (name, value) in trace_counters.items():
+        print("{:<20s} {:>10d}".format(name, value), file=out)
+    if trace_latencies:
+        latencies = sorted(trace_latencies)
+        print("http latency(ms)     avg {:.1f}  p50 {:.1f}  max {:.1f}".format(
+            sum(latencies) * 1000 / len(latencies), latencies[len(latencies) // 2] * 1000, latencies[-1] * 1000),
+            file=out)
+    print("Phases are inclusive and http time is summed over concurrent requests. Work done in summary worker "
+          "processes is not counted.", file=out)
+
+
+# ----
+
+def clean_screen():
+    """Clears the terminal with escape sequences, in process """
+    if sys.stdout.isatty():
+        sys.stdout.write(clear_sequence)
+        sys.stdout.flush()
+
+
+clear_sequence = '\033[H\033[2J'
+
+
+def create_path(year, month, day) -> str:
+    return data_dir() + '{}/{}/{}.dat'.format(year, month, day)
+
+
+def date_to_path(date: datetime) -> str:
+    return create_path(date.year, date.month, date.day)
+
+
+def local_tzname() -> str:
+    from dateutil.tz import tzlocal
+    return datetime.now(tzlocal()).tzname()
+
+
+def time_to_minutes(time: str) -> int:
+    (h, m) = time.split(':')
+    return int(h) * 60 + int(m)
+
+
+def minutes_to_time(minutes: int) -> str:
+    return '{:02d}:{:02d}'.format(minutes // 60, minutes % 60)
+
+
+class Sample(object):
+    """Base sample data class, a sample contains either a message (normal event with/out a tag) or a special command,
+    like end. Time is kept as minutes since midnight, it is parsed once and formatted back only for display and json """
+    __slots__ = ('minutes', 'message', 'tag', 'command', 'jira_sync', 'jira_skip')
+
+    def __init__(self, time, message: str = None, tag: str = None, command: str = None, jira_sync: bool = False,
+                 jira_skip=False):
+        self.minutes: int = time if isinstance(time, int) else time_to_minutes(time)
+        self.message: str = message
+        self.tag: str = tag
+        self.command: str = command
+        self.jira_sync = jira_sync
+        self.jira_skip = jira_skip
+        if message is None and command is None:
+            raise RuntimeError("message and command cannot be empty at the same time")
+        if message is not None and command is not None:
+            raise RuntimeError("Message and command cannot be non-empty at the same time")
+
+    @property
+    def time(self) -> str:
+        return minutes_to_time(self.minutes)
+
+    def hour(self) -> int:
+        return self.minutes // 60
+
+    def minute(self) -> int:
+        return self.minutes % 60
+
+    def to_dict(self) -> dict:
+        return {'time': self.time, 'message': self.message, 'tag': self.tag, 'command': self.command,
+                'jira_sync': self.jira_sync, 'jira_skip': self.jira_skip}
+
+    def to_json(self) -> json:
+        return json.dumps(self.to_dict())
+
+    def __str__(self):
+        if self.command is not None:
+            return '{}  {}'.format(self.time, self.command)
+        else:
+            t = '' if self.tag is None else self.tag
+            return '{:>5s}  [{:^13s}]    {}'.format(self.time, t, self.message)
+
+    @staticmethod
+    def from_dict(js_obj: dict) -> Sample:
+        return Sample(js_obj['time'], js_obj.get('message'), js_obj.get('tag'), js_obj.get('command'),
+                      js_obj.get('jira_sync', False), js_obj.get('jira_skip', False))
+
+    @staticmethod
+    def from_json(json_text) -> Sample:
+        return Sample.from_dict(json.loads(json_text))
+
+
+class SampleBatch(object):
+    """Column oriented container for the samples of a day. Summaries and jira sync walk the columns by index instead
+    of allocating a Sample per row, sample(i) builds a Sample only where one is needed """
+    __slots__ = ('minutes', 'messages', 'tags', 'commands', 'jira_sync', 'jira_skip')
+
+    def __init__(self):
+        self.minutes = array('H')
+        self.messages: [str] = []
+        self.tags: [str] = []
+        self.commands: [str] = []
+        self.jira_sync = bytearray()
+        self.jira_skip = bytearray()
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def __iter__(self):
+        for i in range(len(self.minutes)):
+            yield self.sample(i)
+
+    def append(self, sample: Sample):
+        self.minutes.append(sample.minutes)
+        self.messages.append(sample.message)
+        self.tags.append(sample.tag)
+        self.commands.append(sample.command)
+        self.jira_sync.append(bool(sample.jira_sync))
+        self.jira_skip.append(bool(sample.jira_skip))
+
+    def append_dict(self, js_obj: dict):
+        message = js_obj.get('message')
+        command = js_obj.get('command')
+        if (message is None) == (command is None):
+            raise RuntimeError("Exactly one of message and command should be given")
+        self.minutes.append(time_to_minutes(js_obj['time']))
+        self.messages.append(message)
+        self.tags.append(js_obj.get('tag'))
+        self.commands.append(command)
+        self.jira_sync.append(bool(js_obj.get('jira_sync', False)))
+        self.jira_skip.append(bool(js_obj.get('jira_skip', False)))
+
+    def sample(self, i: int) -> Sample:
+        return Sample(self.minutes[i], self.messages[i], self.tags[i], self.commands[i], bool(self.jira_sync[i]),
+                      bool(self.jira_skip[i]))
+
+    def update(self, i: int, sample: Sample):
+        """Writes the mutable fields of a sample obtained by sample(i) back into the columns """
+        self.tags[i] = sample.tag
+        self.jira_sync[i] = bool(sample.jira_sync)
+        self.jira_skip[i] = bool(sample.jira_skip)
+
+
+class TagStore(object):
+    """Defined tags, deduplicated and sorted. Membership is a set lookup and the tags starting with a prefix are a
+    slice of the sorted list. A tag may be hierarchical like dev/backend, its groups are dev and dev/backend """
+    __slots__ = ('tags', 'members')
+
+    def __init__(self, tags=()):
+        self.members = set(tag for tag in tags if tag)
+        self.tags = sorted(self.members)
+
+    def __contains__(self, tag) -> bool:
+        return tag in self.members
+
+    def __iter__(self):
+        return iter(self.tags)
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def with_prefix(self, prefix: str) -> [str]:
+        tags = self.tags
+        first = bisect_left(tags, prefix)
+        last = first
+        while last < len(tags) and tags[last].startswith(prefix):
+            last += 1
+        return tags[first:last]
+
+    def top_level(self) -> [(str, int)]:
+        """(name, number of tags below it) for every first level group, like ('dev', 2) for dev/backend and
+        dev/frontend """
+        res = []
+        for tag in self.tags:
+            name = tag.split('/', 1)[0]
+            if res and res[-1][0] == name:
+                res[-1] = (name, res[-1][1] + (tag != name))
+            else:
+                res.append((name, int(tag != name)))
+        return res
+
+
+def tag_groups(tag: str) -> [str]:
+    """The groups a hierarchical tag rolls up into, ['dev', 'dev/api'] for dev/api/v2 """
+    parts = tag.split('/')
+    return ['/'.join(parts[:i]) for i in range(1, len(parts))]
+
+
+def create_list_completer(ll):
+    """
+    This is a closure that creates a method that auto-completes from
+    the given list.
+
+    Since the autocomplete function can't be given a list to complete from
+    a closure is used to create the listCompleter function with a list to complete
+    from. The matches of a word are found once and served for every state readline asks for.
+    """
+
+    store = ll if isinstance(ll, TagStore) else TagStore(ll)
+    last = [None, []]
+
+    def list_completer(text, state):
+        if text != last[0]:
+            last[0] = text
+            last[1] = store.with_prefix(text)
+        matches = last[1]
+        return matches[state] + " " if state < len(matches) else None
+
+    return list_completer
+
+
+# -------helpers
+
+def days_ago(days: int) -> datetime:
+    return current_time() - timedelta(days=days)
+
+
+def touch(path):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    if not os.path.exists(path):
+        with open(path, 'a'):
+            os.utime(path, None)
+
+
+def insert(text: str, date: datetime, minus: int, tag=None):
+    t = current_time() - timedelta(minutes=minus)
+    sample = Sample(t.hour * 60 + t.minute, text, tag)
+    get_storage().append(date, sample)
+
+
+class DataLock(object):
+    """Advisory fcntl lock on tim_dir/.lock. Reads and json appends hold it shared: appends are single O_APPEND
+    writes that can't interleave, and readers remember how much of a day they read, so they only wait for rewrites
+    and binary appends. Those read before writing and hold it exclusively. Where fcntl is missing (Windows) nothing
+    is locked """
+    __slots__ = ('exclusive', 'fd')
+
+    def __init__(self, exclusive: bool = False):
+        self.exclusive = exclusive
+        self.fd = None
+
+    def __enter__(self):
+        try:
+            import fcntl
+        except ImportError:
+            return self
+        path = data_dir() + ".lock"
+        try:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        except FileNotFoundError:
+            os.makedirs(data_dir(), exist_ok=True)
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *exc):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def append_line(path: str, line: str) -> int:
+    """Appends a line to the given data file with a single O_APPEND write and returns its offset, the parent
+    directory is only created when the first open fails, so the common case costs a single open call """
+    flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+    try:
+        fd = os.open(path, flags, 0o644)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, flags, 0o644)
+    try:
+        data = (line + "\n").encode('utf-8')
+        os.write(fd, data)
+        return os.lseek(fd, 0, os.SEEK_CUR) - len(data)
+    finally:
+        os.close(fd)
+
+
+def insert_sample(sample: Sample, path: str) -> int:
+    """Appends a sample to a day file in the format of the file, returns its byte offset """
+    binary = is_record_file(path)
+    if binary is None:
+        binary = data_format() == 'binary'
+    if binary:
+        with DataLock(True):
+            return append_record(path, sample)
+    else:
+        with DataLock():
+            return append_line(path, sample.to_json())
+
+
+def insert_command(command: str, date: datetime, time: str):
+    sample = Sample(time, None, None, command)
+    get_storage().append(date, sample)
+
+
+_tags = (None, TagStore())
+
+
+def load_tags() -> TagStore:
+    """Reads the tags file, the store is kept in memory and only built again when the file changes """
+    global _tags
+    tags_path = data_dir() + "tags"
+    touch(tags_path)
+    st = os.stat(tags_path)
+    if _tags[0] == (tags_path, st.st_mtime_ns, st.st_size):
+        return _tags[1]
+    with open(tags_path, "r") as f:
+        store = TagStore(a.strip() for a in f)
+    _tags = ((tags_path, st.st_mtime_ns, st.st_size), store)
+    return store
+
+
+def add_tag(tag) -> bool:
+    """Adds a tag to the tags file, returns False when it is already defined """
+    tag = tag.strip()
+    if tag == '' or tag in load_tags():
+        return False
+    with open(data_dir() + "tags", "a") as o:
+        o.write(tag)
+        o.write("\n")
+    return True
+
+
+def validate_end_time(given: str, last: str) -> bool:
+    if re.match(r'^[0-9]+:[0-9]+$', given):
+        [hs, ms] = given.split(':')
+        (h, m) = (int(hs), int(ms))
+        if h < 24 and m < 60:
+            return last is None or h * 60 + m >= time_to_minutes(last)
+
+    return False
+
+
+def get_yes_no(message: str, default_flag: bool = True) -> bool:
+    complete_message = message + ('(Y/n)' if default_flag else '(y/N)')
+    while True:
+        try:
+            result = input(complete_message).lower()
+        except EOFError:
+            print()
+            return False
+        if result == '':
+            return default_flag
+        elif result == 'y' or result == 'yes':
+            return True
+        elif result == 'n' or result == 'no':
+            return False
+        else:
+            print('Please enter y or n (empty is treated as default value)')
+
+
+def get_end_hour(last: str = None) -> str:
+    """The end hour the user enters, None at the end of the input """
+    message = 'Enter end hour' + ('(last Time stamp : {}) :'.format(last) if last is not None else ':')
+    while True:
+        try:
+            result = input(message)
+        except EOFError:
+            print()
+            return None
+        if validate_end_time(result, last):
+            return result
+
+
+def review(date: datetime, skip_tagged: bool = True):
+    clean_screen()
+    storage = get_storage()
+    storage.backup(date)
+    samples = storage.load(date)
+    pending = [sample for sample in samples
+               if sample.message is not None and not (skip_tagged and sample.tag is not None)]
+    title = "{}/{}/{} Logs:".format(date.year, date.month, date.day)
+    changed = review_screen().ask_tags(title, pending, load_tags(), load_rules())
+    if pending:
+        clean_screen()
+    print(title)
+
+    for sample in samples:
+        print(sample)
+
+    if len(samples) != 0 and samples[-1].command is None:
+        if get_yes_no('This timesheet is not ended, would you like to End?'):
+            end_time = get_end_hour(samples[-1].time)
+            if end_time is not None:
+                sample = Sample(end_time, None, None, 'END')
+                samples.append(sample)
+                changed = True
+
+    if changed and get_yes_no('Save?'):
+        print('saving')
+        storage.save(date, samples)
+
+
+class ReviewScreen(object):
+    """Asks for the tags of activities a page at a time, a page is tagged with one input line (see parse_tag_line).
+    On a terminal the page is redrawn in place and readline completes tags, it is set up once for the whole session
+    (a summary reviews many days). Otherwise pages are printed as plain text and read line by line """
+    __slots__ = ('tty', 'completion_tags')
+
+    def __init__(self, tty: bool):
+        self.tty = tty
+        self.completion_tags = None
+        if tty:
+            import readline
+            readline.set_completer_delims(' \t,=')
+            readline.parse_and_bind("tab: complete")
+
+    def page_size(self, header_lines: int) -> int:
+        if not self.tty:
+            return sys.maxsize
+        import shutil
+        return max(1, shutil.get_terminal_size().lines - header_lines - 3)
+
+    def ask_tags(self, title: str, samples: [Sample], defined_tags: TagStore, rules: TagRules) -> bool:
+        """Sets the tags the user enters, True when a tag changed. The input line of a page is pre-filled with the
+        current tags and the suggestions of the autotag rules """
+        if not samples:
+            return False
+        if self.tty and self.completion_tags is not defined_tags:
+            import readline
+            readline.set_completer(create_list_completer(defined_tags))
+            self.completion_tags = defined_tags
+        header = [title] + tags_lines(defined_tags) + ["---------"]
+        size = self.page_size(len(header))
+        changed = False
+        for first in range(0, len(samples), size):
+            page = samples[first:first + size]
+            numbers = range(first + 1, first + len(page) + 1)
+            answer = [sample.tag or rules.suggest(sample.message) or '-' for sample in page]
+            while answer and answer[-1] == '-':
+                answer.pop()
+            line = ' '.join(answer)
+            error = None
+            while True:
+                self.draw(header, page, numbers, error)
+                line = self.read(line)
+                (tags, error) = parse_tag_line(line, numbers, defined_tags)
+                if error is None:
+                    break
+            for (sample, tag) in zip(page, tags):
+                if tag is not None and tag != sample.tag:
+                    sample.tag = tag
+                    changed = True
+        return changed
+
+    def draw(self, header: [str], page: [Sample], numbers: range, error: str):
+        lines = header + ['{:>3}  {}'.format(n, sample) for (n, sample) in zip(numbers, page)]
+        if error is not None:
+            lines.append(error)
+        lines.append("Tags in order, - keeps one, N=tag or N-M=tag by number:")
+        sys.stdout.write((clear_sequence if self.tty else '') + '\n'.join(lines) + '\n')
+        sys.stdout.flush()
+
+    def read(self, prefill: str) -> str:
+        """A line of input, empty at the end of the input """
+        try:
+            if not self.tty:
+                return input('[{}] '.format(prefill) if prefill else '') or prefill
+            import readline
+            readline.set_startup_hook(lambda: readline.insert_text(prefill))
+            try:
+                return input()
+            finally:
+                readline.set_startup_hook()
+        except EOFError:
+            return ''
+
+
+_review_screen: ReviewScreen = None
+
+
+def review_screen() -> ReviewScreen:
+    global _review_screen
+    if _review_screen is None:
+        _review_screen = ReviewScreen(sys.stdin.isatty() and sys.stdout.isatty())
+    return _review_screen
+
+
+def parse_tag_line(line: str, numbers: range, defined_tags: TagStore) -> ([str], str):
+    """The tags a line gives to the activities numbered by <numbers>, None for the ones it leaves as they are, and
+    None or the error of an invalid line. Tags go to the activities in order, - skips one, N=tag and N-M=tag pick
+    activities by number and the next tags continue after them. Tags are separated by spaces or commas """
+    tags = [None] * len(numbers)
+    line = line.strip()
+    tokens = [line] if line in defined_tags else [token for token in re.split(r'[\s,]+', line) if token]
+    position = 0
+    for token in tokens:
+        (target, _, tag) = token.rpartition('=')
+        if target:
+            match = re.match(r'^([0-9]+)(?:-([0-9]+))?$', target)
+            if match is None:
+                return None, "{} is not an activity number".format(target)
+            (low, high) = (int(match.group(1)), int(match.group(2) or match.group(1)))
+            if low > high or low not in numbers or high not in numbers:
+                return None, "{} is not on this page".format(target)
+            span = range(low - numbers.start, high - numbers.start + 1)
+        elif position < len(tags):
+            span = range(position, position + 1)
+        else:
+            return None, "There are more tags than activities"
+        if tag != '-' and tag not in defined_tags:
+            return None, "{} is not a valid tag".format(tag)
+        if tag != '-':
+            for i in span:
+                tags[i] = tag
+        position = span.stop
+    return tags, None
+
+
+tags_listed = 40
+
+
+def tags_lines(defined_tags: TagStore) -> [str]:
+    """Lists the tags, a long list is folded into its first level groups """
+    if len(defined_tags) <= tags_listed:
+        return ["Available tags : " + ", ".join(defined_tags)]
+    return ["Available tags : " + ", ".join(name if count == 0 else '{}/ ({})'.format(name, count)
+                                            for (name, count) in defined_tags.top_level()),
+            "Use tab to complete a group"]
+
+
+# ------ Autotag
+# The rules file maps messages to tags, one rule per line: a tag, then a regular expression searched in the message
+# (case insensitive, ^#PRJ- matches the issues of a project). The first matching rule wins, # starts a comment line.
+
+class TagRules(object):
+    """Rules compiled into a single regular expression, an alternative per rule in file order. Patterns that can't
+    share it are matched one rule at a time instead: numbered backreferences would point at the groups of other
+    alternatives, and inline global flags or repeated group names don't compile in a combined expression """
+    __slots__ = ('tags', 'matcher', 'patterns')
+
+    def __init__(self, rules: [(str, str)] = ()):
+        self.tags = [tag for (tag, _) in rules]
+        self.matcher = None
+        self.patterns = None
+        if not rules:
+            return
+        if not any(numbered_backreference.search(pattern) for (_, pattern) in rules):
+            # the lazy prefix crosses newlines like search() does in the one rule at a time mode
+            alternatives = ['(?P<r{}>(?s:.*?)(?:{}))'.format(i, pattern) for (i, (_, pattern)) in enumerate(rules)]
+            try:
+                self.matcher = re.compile('|'.join(alternatives), re.IGNORECASE)
+                return
+            except re.error:
+                pass
+        self.patterns = [re.compile(pattern, re.IGNORECASE) for (_, pattern) in rules]
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def suggest(self, message: str) -> str:
+        """The tag of the first rule matching the message, None when no rule matches """
+        if message is None:
+            return None
+        if self.matcher is not None:
+            m = self.matcher.match(message)
+            return None if m is None else self.tags[int(m.lastgroup[1:])]
+        for (tag, pattern) in zip(self.tags, self.patterns or ()):
+            if pattern.search(message):
+                return tag
+        return None
+
+
+# a \1 whose backslash is not itself escaped
+numbered_backreference = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]')
+
+
+def rules_path() -> str:
+    return data_dir() + "rules"
+
+
+_rules = (None, TagRules())
+
+
+def load_rules() -> TagRules:
+    """Reads the rules file, like the tags it is only compiled again when the file changes. Rules with an invalid
+    pattern or an undefined tag are reported and left out """
+    global _rules
+    try:
+        st = os.stat(rules_path())
+    except FileNotFoundError:
+        return TagRules()
+    if _rules[0] == (rules_path(), st.st_mtime_ns, st.st_size):
+        return _rules[1]
+    defined_tags = load_tags()
+    rules = []
+    with open(rules_path(), 'r') as f:
+        for (number, line) in enumerate(f, 1):
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            parts = line.split(None, 1)
+            if len(parts) != 2:
+                print("rules line {}: expected a tag and a pattern".format(number))
+                continue
+            (tag, pattern) = parts
+            if tag not in defined_tags:
+                print("rules line {}: {} is not a defined tag".format(number, tag))
+                continue
+            try:
+                re.compile(pattern, re.IGNORECASE)
+            except re.error as e:
+                print("rules line {}: {}".format(number, e))
+                continue
+            rules.append((tag, pattern))
+    _rules = ((rules_path(), st.st_mtime_ns, st.st_size), TagRules(rules))
+    return _rules[1]
+
+
+def autotag(first: int, last: int):
+    """Tags the untagged activities of the days from <first> days ago until <last> days ago with the rules, every
+    changed day is saved once """
+    rules = load_rules()
+    if len(rules) == 0:
+        print("No rules defined in {}".format(rules_path()))
+        return
+    storage = get_storage()
+    (days, tagged, unmatched) = (0, 0, 0)
+    for x in range(first, last + 1):
+        date = days_ago(x)
+        samples = storage.load(date)
+        changed = 0
+        for sample in samples:
+            if sample.message is not None and sample.tag is None:
+                tag = rules.suggest(sample.message)
+                if tag is None:
+                    unmatched += 1
+                else:
+                    sample.tag = tag
+                    changed += 1
+        if changed:
+            storage.save(date, samples)
+            days += 1
+            tagged += changed
+    print("Tagged {} activities in {} days, {} untagged activities match no rule".format(tagged, days, unmatched))
+
+
+def open_editor(path):
+    from subprocess import call
+    touch(path)
+    call(EDITOR.split(" ") + [path])
+
+
+def save_file(samples: [Sample], path: str, binary: bool = None, base: (int, int) = None):
+    """Rewrites a day file through a temporary file and an atomic rename under the exclusive lock, readers see
+    either the old or the new content. The file keeps its format, a new or empty file gets the configured one,
+    unless binary is given. base is the (inode, size) of the file when the samples were read, samples appended to
+    it since then are kept after the given ones instead of being lost """
+    with DataLock(True):
+        if base is not None:
+            samples = list(samples) + appended_since(path, base)
+        if binary is None:
+            binary = is_record_file(path)
+            if binary is None:
+                binary = data_format() == 'binary'
+        tmp_path = path + '.tmp'
+        if binary:
+            with open(tmp_path, 'wb') as f:
+                f.write(record_magic + encode_records(samples, {}, len(record_magic)))
+        else:
+            with open(tmp_path, 'w') as f:
+                f.write("\n".join(map(lambda x: x.to_json(), samples)))
+                f.write("\n")
+        os.replace(tmp_path, path)
+
+
+def file_base(path: str) -> (int, int):
+    """(inode, size) of a file, None when it is missing """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size
+
+
+def appended_since(path: str, base: (int, int)) -> [Sample]:
+    """The samples appended to a file after it had the given (inode, size), (0, 0) standing for a missing file. A
+    file replaced in the meantime is not merged, the last rewrite wins """
+    current = file_base(path)
+    if current is None or base[0] not in (0, current[0]) or current[1] <= base[1]:
+        return []
+    return [sample for (offset, sample) in load_offsets(path) if offset >= base[1]]
+
+
+# ------ Record codec
+# Day files are json lines by default. The binary format starts with record_magic, followed by 'S' records holding
+# the utf-8 strings (messages, tags and commands) and fixed width 'R' records for the samples. A string is written
+# once per file and records refer to it by its byte offset, 0 standing for None. Readers detect the format from the
+# header, so json and binary days can be mixed in one history.
+
+record_magic = b'TIMR\x01\n'
+record_format = '<cHIIIB'  # 'R', minutes, message, tag, command, flags (1 jira_sync, 2 jira_skip)
+record_size = 16
+string_format = '<cI'  # 'S', length of the utf-8 bytes that follow
+string_size = 5
+data_formats = ('json', 'binary')
+
+
+def data_format() -> str:
+    """Format of new day files, TIM_FORMAT or the format chosen by the last -c convert, json by default """
+    name = os.environ.get('TIM_FORMAT')
+    if name is None:
+        try:
+            with open(data_dir() + 'format', 'r') as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            name = 'json'
+    return name if name in data_formats else 'json'
+
+
+def is_record_file(path: str) -> bool:
+    """Whether a day file is binary, None when it does not exist or is empty """
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(len(record_magic))
+    except FileNotFoundError:
+        return None
+    return None if head == b'' else head == record_magic
+
+
+def encode_records(samples: [Sample], strings: dict, offset: int) -> bytearray:
+    """Encodes samples to be written at byte <offset> of a file. strings maps the strings already in the file to
+    their offsets, the new strings are written before the first record using them and added to it """
+    import struct
+    out = bytearray()
+    for sample in samples:
+        ids = []
+        for value in (sample.message, sample.tag, sample.command):
+            if value is None:
+                ids.append(0)
+                continue
+            string_id = strings.get(value)
+            if string_id is None:
+                string_id = strings[value] = offset + len(out)
+                data = value.encode('utf-8')
+                out += struct.pack(string_format, b'S', len(data))
+                out += data
+            ids.append(string_id)
+        flags = bool(sample.jira_sync) | bool(sample.jira_skip) << 1
+        out += struct.pack(record_format, b'R', sample.minutes, ids[0], ids[1], ids[2], flags)
+    return out
+
+
+def decode_records(data, batch: SampleBatch = None, offsets: array = None, strings: dict = None,
+                   position: int = None) -> int:
+    """Decodes the records of a binary day file into the batch, their offsets into offsets and the strings by offset
+    into strings. Decoding starts after the header, or at <position> with the strings read before it, and returns
+    the position where it stopped: the end of the file or a record cut short by an interrupted write """
+    import struct
+    strings = {} if strings is None else strings
+    strings[0] = None
+    position = len(record_magic) if position is None else position
+    end = len(data)
+    while position < end:
+        kind = data[position:position + 1]
+        if kind == b'S' and position + string_size <= end:
+            (_, length) = struct.unpack_from(string_format, data, position)
+            start = position + string_size
+            strings[position] = data[start:start + length].decode('utf-8')
+            position = start + length
+        elif kind == b'R' and position + record_size <= end:
+            if batch is not None:
+                (_, minutes, message, tag, command, flags) = struct.unpack_from(record_format, data, position)
+                batch.minutes.append(minutes)
+                batch.messages.append(strings[message])
+                batch.tags.append(strings[tag])
+                batch.commands.append(strings[command])
+                batch.jira_sync.append(flags & 1)
+                batch.jira_skip.append(flags >> 1 & 1)
+                if offsets is not None:
+                    offsets.append(position)
+            position += record_size
+        else:
+            break
+    return position
+
+
+_record_strings = (None, {})
+
+
+def append_record(path: str, sample: Sample) -> int:
+    """Appends a sample to a binary day file, creating it when it is missing or empty, and returns the offset of its
+    record. Only the header of the file is read, the strings of the sample are written along with the record in a
+    single O_APPEND write. The strings written by the last append are reused while the file has not changed since,
+    other strings are written again: decoding keys strings by offset and rewriting the day shares them again.
+    Callers hold the exclusive DataLock, the offsets of the strings depend on the size of the file """
+    global _record_strings
+    flags = os.O_RDWR | os.O_APPEND | os.O_CREAT
+    try:
+        fd = os.open(path, flags, 0o644)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, flags, 0o644)
+    try:
+        st = os.fstat(fd)
+        if st.st_size == 0:
+            (head, strings) = (record_magic, {})
+        elif os.read(fd, len(record_magic)) != record_magic:
+            raise ValueError("{} is not a binary day file".format(path))
+        else:
+            key = (path, st.st_ino, st.st_size, st.st_mtime_ns)
+            (head, strings) = (b'', _record_strings[1] if _record_strings[0] == key else {})
+        offset = st.st_size + len(head)
+        out = encode_records([sample], strings, offset)
+        os.write(fd, head + out)
+        st = os.fstat(fd)
+        _record_strings = ((path, st.st_ino, st.st_size, st.st_mtime_ns), strings)
+    finally:
+        os.close(fd)
+    return offset + len(out) - record_size
+
+
+def convert_days(name: str):
+    """Rewrites every day file in the given format and makes it the format of new days """
+    if name not in data_formats:
+        print("Unknown format '{}', expected one of: {}".format(name, ", ".join(data_formats)))
+        return
+    storage = get_storage()
+    if storage.name != 'file':
+        print("Day files are only used by the file storage, the storage is {}".format(storage.name))
+        return
+    count = 0
+    for date in storage.dates():
+        path = date_to_path(date)
+        if is_record_file(path) is not None and is_record_file(path) != (name == 'binary'):
+            save_file(load_file(path), path, name == 'binary')
+            index_day(date)
+            count += 1
+    with open(data_dir() + 'format', 'w') as f:
+        f.write(name + "\n")
+    print("Converted {} day files, new days are written as {}.".format(count, name))
+
+
+def read_day(path: str, bases: dict = None):
+    """Reads a day file, returns (records, None) for a binary file, records being a read only memory map of it, and
+    (None, lines) for a json file. The (inode, size) of what was read is stored in bases, samples appended while
+    reading are past that size """
+    with trace_phase('io'):
+        with open(path, 'rb') as f:
+            head = f.read(len(record_magic))
+            if head == record_magic:
+                import mmap
+                (records, lines) = (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), None)
+                size = len(records)
+            else:
+                data = head + f.read()
+                (records, lines, size) = (None, data.decode('utf-8').splitlines(), len(data))
+            if bases is not None:
+                bases[path] = (os.fstat(f.fileno()).st_ino, size)
+    if trace_enabled:
+        trace_count('files_opened')
+        trace_count('bytes_read', len(records) if records is not None else sum(map(len, lines)))
+    return records, lines
+
+
+def load_file(path, bases: dict = None) -> [Sample]:
+    arr = []
+    if bases is not None:
+        bases[path] = (0, 0)
+    if os.path.exists(path):
+        (records, lines) = read_day(path, bases)
+        with trace_phase('decode'):
+            if records is not None:
+                batch = SampleBatch()
+                with records:
+                    decode_records(records, batch)
+                arr = list(batch)
+            for line in lines or ():
+                if line.strip() != '':
+                    sample = Sample.from_json(line.strip())
+                    arr.append(sample)
+        trace_count('samples_parsed', len(arr))
+    return arr
+
+
+def load_batch(path, bases: dict = None) -> SampleBatch:
+    batch = SampleBatch()
+    if bases is not None:
+        bases[path] = (0, 0)
+    if os.path.exists(path):
+        (records, lines) = read_day(path, bases)
+        with trace_phase('decode'):
+            if records is not None:
+                with records:
+                    decode_records(records, batch)
+            for line in lines or ():
+                line = line.strip()
+                if line != '':
+                    batch.append_dict(json.loads(line))
+        trace_count('samples_parsed', len(batch))
+    return batch
+
+
+tail_block_size = 4096
+
+
+def read_last_lines(path: str, count: int = 1) -> [str]:
+    """Returns the last <count> non-empty lines of a file, reading it backwards in blocks from the end, so the cost
+    does not depend on the size of the file """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return []
+    trace_count('files_opened')
+    with f:
+        position = f.seek(0, os.SEEK_END)
+        data = b''
+        lines = []
+        while position > 0:
+            size = min(tail_block_size, position)
+            position -= size
+            f.seek(position)
+            data = f.read(size) + data
+            trace_count('bytes_read', size)
+            pieces = data.split(b'\n')
+            # the first piece may be the end of a line that starts before this block
+            lines = [p for p in (pieces if position == 0 else pieces[1:]) if p.strip() != b'']
+            if len(lines) >= count:
+                break
+    return [line.decode('utf-8').strip() for line in lines[-count:]]
+
+
+def read_last_record(path: str) -> [Sample]:
+    """The last sample of a binary day file, read from the end: every append ends with a record of record_size
+    bytes, and its strings are read at their offsets. None when the file does not end with a record """
+    import struct
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END) - record_size
+        if position < len(record_magic):
+            return None if position + record_size > len(record_magic) else []
+        f.seek(position)
+        data = f.read(record_size)
+        if data[:1] != b'R':
+            return None
+        (_, minutes, message, tag, command, flags) = struct.unpack(record_format, data)
+        values = []
+        for string_id in (message, tag, command):
+            if string_id == 0:
+                values.append(None)
+                continue
+            if string_id < len(record_magic) or string_id > position - string_size:
+                return None
+            f.seek(string_id)
+            (kind, length) = struct.unpack(string_format, f.read(string_size))
+            if kind != b'S':
+                return None
+            values.append(f.read(length).decode('utf-8'))
+    trace_count('files_opened')
+    trace_count('bytes_read', record_size)
+    return [Sample(minutes, values[0], values[1], values[2], bool(flags & 1), bool(flags & 2))]
+
+
+def load_last(path: str, count: int = 1) -> [Sample]:
+    """The last <count> samples of a day file. Only the end of the file is read, except for several samples of a
+    binary file, whose records can't be told from strings when reading backwards """
+    if is_record_file(path):
+        last = read_last_record(path) if count == 1 else None
+        return load_file(path)[-count:] if last is None else last
+    return [Sample.from_json(line) for line in read_last_lines(path, count)]
+
+
+def print_status(date: datetime):
+    """Prints the current activity of the day and how long it has been going on """
+    last = get_storage().last(date)
+    if len(last) == 0:
+        print("No activity yet.")
+        return
+    sample = last[0]
+    if sample.command is not None:
+        print("Day ended at {}".format(sample.time))
+        return
+    elapsed = date.hour * 60 + date.minute - sample.minutes
+    print("{}  ({}h {:02d}m)".format(sample, elapsed // 60, elapsed % 60))
+
+
+def cat(date: datetime):
+    print("{}/{}/{} Logs:".format(date.year, date.month, date.day))
+    print("use -h to show help and commands")
+    print("-----------------------------------\n")
+    arr = get_storage().load(date)
+    with trace_phase('render'):
+        for sample in arr:
+            print(sample)
+
+
+# ------ Watch
+
+watch_interval = 5
+watch_recent = 5
+
+
+class DayTail(object):
+    """Follows the day file of a date. Every poll decodes only what was appended since the previous one, a file that
+    was rewritten (a new inode or a smaller size) is read again from the start. Running tag totals are kept up to
+    date as samples arrive, the open activity is left to the caller """
+    __slots__ = ('date', 'path', 'inode', 'offset', 'binary', 'strings', 'batch', 'tag_length')
+
+    def __init__(self, date: datetime):
+        self.date = date
+        self.path = date_to_path(date)
+        self.reset(None)
+
+    def reset(self, inode):
+        self.inode = inode
+        self.offset = 0
+        self.binary = False
+        self.strings = {}
+        self.batch = SampleBatch()
+        self.tag_length = {}
+
+    def poll(self) -> bool:
+        """Reads the new samples, returns whether there were any """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            self.reset(st.st_ino)
+        if st.st_size == self.offset:
+            return False
+        first = len(self.batch)
+        with open(self.path, 'rb') as f:
+            if self.offset == 0 and f.read(len(record_magic)) == record_magic:
+                self.binary = True
+                self.offset = len(record_magic)
+            if self.binary:
+                import mmap
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    self.offset = decode_records(data, self.batch, strings=self.strings, position=self.offset)
+            else:
+                f.seek(self.offset)
+                data = f.read()
+                complete = data.rfind(b'\n') + 1
+                for line in data[:complete].decode('utf-8').splitlines():
+                    if line.strip() != '':
+                        self.batch.append_dict(json.loads(line))
+                self.offset += complete
+        minutes = self.batch.minutes
+        for i in range(max(1, first), len(self.batch)):
+            add_dict(self.tag_length, self.batch.tags[i - 1], minutes[i] - minutes[i - 1])
+        return len(self.batch) > first
+
+
+def watch_lines(tail: DayTail, clock: datetime) -> [str]:
+    batch = tail.batch
+    lines = ["{}  {:02d}:{:02d}".format(tail.date.strftime('%Y/%m/%d %A'), clock.hour, clock.minute), ""]
+    tag_length = dict(tail.tag_length)
+    if len(batch) == 0:
+        lines.append("No activity yet.")
+    elif batch.commands[-1] is not None:
+        lines.append("Day ended at {}".format(minutes_to_time(batch.minutes[-1])))
+    else:
+        elapsed = clock.hour * 60 + clock.minute - batch.minutes[-1]
+        add_dict(tag_length, batch.tags[-1], elapsed)
+        lines.append("{}  ({}h {:02d}m)".format(batch.sample(len(batch) - 1), elapsed // 60, elapsed % 60))
+    lines.append("")
+    for i in range(max(0, len(batch) - 1 - watch_recent), len(batch) - 1):
+        lines.append(str(batch.sample(i)))
+    lines.append("")
+    for (tag, le) in sorted(tag_length.items(), key=lambda kv: kv[1], reverse=True):
+        lines.append(" {:<15s} {:3d}h {:02d}m".format('-' if tag is None else tag, le // 60, le % 60))
+    total = sum(tag_length.values())
+    lines.append(" {:<15s} {:3d}h {:02d}m".format('total', total // 60, total % 60))
+    return lines
+
+
+def watch(interval: float = watch_interval):
+    """Shows the current activity, the last ones and today's tag totals, refreshed every <interval> seconds until
+    interrupted. Moves on to the new day file at midnight """
+    if get_storage().name != 'file':
+        print("Watching needs the file storage, the storage is {}".format(get_storage().name))
+        return
+    tty = sys.stdout.isatty()
+    tail = None
+    shown = None
+    try:
+        while True:
+            clock = current_time()
+            if tail is None or date_key(tail.date) != date_key(clock):
+                tail = DayTail(clock)
+            tail.poll()
+            text = "\n".join(watch_lines(tail, clock))
+            if text != shown:
+                # home and clear the screen, without running clear every few seconds
+                sys.stdout.write(("\033[H\033[J" if tty else "\n") + text + "\n")
+                sys.stdout.flush()
+                shown = text
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("")
+
+
+# -----------------
+
+def diff(start: Sample, end: Sample) -> int:
+    return end.minutes - start.minutes
+
+
+def diff_times(start: str, end: str) -> int:
+    return time_to_minutes(end) - time_to_minutes(start)
+
+
+def add_dict(dic, key, value):
+    if key in dic:
+        dic[key] += value
+    else:
+        dic[key] = value
+
+
+class DaySummary(object):
+    """Aggregates of a single day: day length and tag/issue totals in minutes. Dictionaries keep the order in which
+    keys were first seen, so merging days in order gives the same tables as aggregating all samples at once """
+    __slots__ = ('length', 'tag_length', 'tag_count', 'issue_sum')
+
+    def __init__(self, length: int = 0, tag_length: dict = None, tag_count: dict = None, issue_sum: dict = None):
+        self.length = length
+        self.tag_length = {} if tag_length is None else tag_length
+        self.tag_count = {} if tag_count is None else tag_count
+        self.issue_sum = {} if issue_sum is None else issue_sum
+
+    def to_dict(self) -> dict:
+        return {'length': self.length,
+                'tags': [[tag, le, self.tag_count[tag]] for (tag, le) in self.tag_length.items()],
+                'issues': [[issue, le] for (issue, le) in self.issue_sum.items()]}
+
+    @staticmethod
+    def from_dict(js_obj: dict) -> DaySummary:
+        day = DaySummary(js_obj['length'])
+        for (tag, le, count) in js_obj['tags']:
+            day.tag_length[tag] = le
+            day.tag_count[tag] = count
+        for (issue, le) in js_obj['issues']:
+            day.issue_sum[issue] = le
+        return day
+
+
+def issue_of(message: str) -> str:
+    """The issue of an activity as summaries group it: the whole message when it starts with '#' """
+    return message if message is not None and message.startswith('#') else None
+
+
+def issue_key(message: str, prefix: str = None) -> str:
+    """The Jira key of an issue message: its first word without the '#', a bare number gets the prefix in front """
+    if issue_of(message) is None:
+        return None
+    key = message.split(" ")[0].replace('#', '')
+    if "-" not in key and prefix is not None:
+        key = prefix + '-' + key
+    return key
+
+
+def summarize_day(day: SampleBatch) -> DaySummary:
+    """Walks the samples of a day pairwise. Consecutive activities with the same tag are merged into one run, which
+    is counted once; a run that is still open at the end of the day is not counted """
+    summary = DaySummary()
+    tag_length = summary.tag_length
+    tag_count = summary.tag_count
+    issue_sum = summary.issue_sum
+    buffer = 0
+
+    minutes = day.minutes
+    tags = day.tags
+    messages = day.messages
+    summary.length = minutes[-1] - minutes[0]
+    for i in range(1, len(minutes)):
+        p = i - 1
+        tag = tags[p]
+        d = minutes[i] - minutes[p]
+        issue = issue_of(messages[p])
+        if issue is not None:
+            add_dict(issue_sum, issue, d)
+
+        if buffer != 0:
+            buffer += d
+            if tags[i] != tag:
+                add_dict(tag_count, tag, 1)
+                add_dict(tag_length, tag, buffer)
+                buffer = 0
+        else:
+            if tag == tags[i]:
+                buffer = d
+            else:
+                add_dict(tag_count, tag, 1)
+                add_dict(tag_length, tag, d)
+    return summary
+
+
+def is_reviewed(day: SampleBatch) -> bool:
+    """True when review() would have nothing to ask for this day: every activity is tagged and the day is ended """
+    if len(day) == 0:
+        return True
+    if day.commands[-1] is None:
+        return False
+    for i in range(len(day)):
+        if day.messages[i] is not None and day.tags[i] is None:
+            return False
+    return True
+
+
+class Summary(object):
+    """Accumulates day summaries of a range """
+
+    def __init__(self):
+        self.work_days = 0
+        self.total_day_length = 0
+        self.tag_length = {}
+        self.tag_count = {}
+        self.issue_sum = {}
+
+    def add_day(self, day: DaySummary):
+        self.work_days += 1
+        self.total_day_length += day.length
+        for tag in day.tag_length:
+            add_dict(self.tag_length, tag, day.tag_length[tag])
+            add_dict(self.tag_count, tag, day.tag_count[tag])
+        for issue in day.issue_sum:
+            add_dict(self.issue_sum, issue, day.issue_sum[issue])
+
+    def merge(self, other: Summary):
+        """Adds the totals of another summary, the work days of a team are person days """
+        self.work_days += other.work_days
+        self.total_day_length += other.total_day_length
+        for tag in other.tag_length:
+            add_dict(self.tag_length, tag, other.tag_length[tag])
+            add_dict(self.tag_count, tag, other.tag_count[tag])
+        for issue in other.issue_sum:
+            add_dict(self.issue_sum, issue, other.issue_sum[issue])
+
+    def daily_avg(self) -> float:
+        if self.work_days == 0:
+            return 0
+        else:
+            return self.total_day_length / self.work_days
+
+
+# ------ Summary cache
+
+summary_cache_version = 1
+
+
+parallel_min_days = 64
+# Uncached ranges of at least numpy_min_days days are summarized with numpy. bench.py engines found no range up to
+# 10000 days where it beats Python: loading the days dominates both engines and the grouped totals still loop in
+# Python. So numpy is off by default, TIM_ENGINE=numpy selects it for every range
+numpy_min_days = None
+
+
+def summary_jobs() -> int:
+    """Number of processes used to summarize uncached days, TIM_JOBS or the number of cpus """
+    try:
+        return max(1, int(os.environ['TIM_JOBS']))
+    except (KeyError, ValueError):
+        return os.cpu_count() or 1
+
+
+def day_cache_key(date: datetime) -> str:
+    return '{}/{}/{}'.format(date.year, date.month, date.day)
+
+
+def day_cache_entry(path: str) -> dict:
+    st = os.stat(path)
+    day = load_batch(path)
+    return {'mtime': st.st_mtime_ns, 'size': st.st_size, 'reviewed': is_reviewed(day),
+            'summary': None if len(day) == 0 else summarize_day(day).to_dict()}
+
+
+def day_cache_entries(paths: [str], numpy_engine: bool = False) -> [dict]:
+    """Summarizes a chunk of day files, this is the unit of work of the process pool. The engine is chosen for the
+    whole range by uses_numpy, numpy is only imported when it was chosen and falls back to Python when missing """
+    np = summary_numpy() if numpy_engine else None
+    if np is not None:
+        return numpy_day_cache_entries(paths, np)
+    return [day_cache_entry(path) for path in paths]
+
+
+def uses_numpy(days: int) -> bool:
+    """Whether a range of <days> uncached days is summarized with numpy: TIM_ENGINE=numpy, or a range of at least
+    numpy_min_days unless TIM_ENGINE=python """
+    engine = os.environ.get('TIM_ENGINE')
+    if engine is not None:
+        return engine == 'numpy'
+    return numpy_min_days is not None and days >= numpy_min_days
+
+
+def summary_numpy():
+    """Returns numpy when it is installed, otherwise None """
+    try:
+        with trace_phase('imports'):
+            import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+def numpy_day_cache_entries(paths: [str], np) -> [dict]:
+    """Vectorized equivalent of day_cache_entries. The samples of all days are loaded into columns of start minutes,
+    tag ids, issue ids and day ids, durations come from one array difference and totals from grouped reductions,
+    Python only loops over the resulting (day, tag) and (day, issue) groups """
+    minutes = array('H')
+    # 64 bit ids on every platform, a C long is 32 bits on Windows
+    day_ids = array('q')
+    tag_ids = array('q')
+    issue_ids = array('q')
+    tag_index = {}
+    issue_index = {}
+    entries = []
+    for (day_id, path) in enumerate(paths):
+        st = os.stat(path)
+        day = load_batch(path)
+        entries.append({'mtime': st.st_mtime_ns, 'size': st.st_size, 'reviewed': is_reviewed(day), 'summary': None})
+        minutes.extend(day.minutes)
+        day_ids.extend([day_id] * len(day))
+        for tag in day.tags:
+            tag_ids.append(tag_index.setdefault(tag, len(tag_index)))
+        for message in day.messages:
+            issue = issue_of(message)
+            if issue is not None:
+                issue_ids.append(issue_index.setdefault(issue, len(issue_index)))
+            else:
+                issue_ids.append(-1)
+
+    tag_names = list(tag_index)
+    issue_names = list(issue_index)
+    m = np.frombuffer(minutes, dtype=np.uint16).astype(np.int64)
+    days = np.frombuffer(day_ids, dtype=np.int64)
+    tags = np.frombuffer(tag_ids, dtype=np.int64)
+    issues = np.frombuffer(issue_ids, dtype=np.int64)
+
+    counts = np.bincount(days, minlength=len(paths))
+    ends = np.cumsum(counts)
+    summaries = [None] * len(paths)
+    for day_id in np.nonzero(counts)[0]:
+        length = int(m[ends[day_id] - 1] - m[ends[day_id] - counts[day_id]])
+        summaries[day_id] = DaySummary(length)
+
+    # pair p is (sample p, sample p + 1) of the same day
+    pairs = np.nonzero(days[1:] == days[:-1])[0]
+    if len(pairs) > 0:
+        d = m[pairs + 1] - m[pairs]
+        pair_days = days[pairs]
+        pair_tags = tags[pairs]
+
+        # a pair closes its run when the next sample has another tag, runs start after a closing pair or a new day
+        closes = tags[pairs + 1] != pair_tags
+        starts = np.ones(len(pairs), dtype=bool)
+        starts[1:] = (pair_days[1:] != pair_days[:-1]) | closes[:-1]
+        run_ids = np.cumsum(starts) - 1
+        run_length = np.bincount(run_ids, weights=d)
+        run_end = np.append(np.nonzero(starts[1:])[0], len(pairs) - 1)
+        closed = closes[run_end]
+        run_end = run_end[closed]
+        add_groups(np, summaries, pair_days[run_end], pair_tags[run_end], run_length[closed], tag_names,
+                   'tag_length', 'tag_count')
+
+        issue_pairs = np.nonzero(issues[pairs] >= 0)[0]
+        add_groups(np, summaries, pair_days[issue_pairs], issues[pairs][issue_pairs], d[issue_pairs], issue_names,
+                   'issue_sum', None)
+
+    for (entry, summary) in zip(entries, summaries):
+        if summary is not None:
+            entry['summary'] = summary.to_dict()
+    return entries
+
+
+def add_groups(np, summaries: [DaySummary], group_days, group_ids, values, names: [str], length_field: str,
+               count_field: str = None):
+    """Sums values by (day, id) and stores the totals in the day summaries, in the order in which each group first
+    appears, which is the order summarize_day() adds them """
+    if len(group_days) == 0:
+        return
+    keys = group_days * len(names) + group_ids
+    (unique, first, inverse) = np.unique(keys, return_index=True, return_inverse=True)
+    lengths = np.bincount(inverse, weights=values)
+    counts = np.bincount(inverse)
+    for g in np.argsort(first, kind='stable'):
+        summary = summaries[unique[g] // len(names)]
+        name = names[unique[g] % len(names)]
+        getattr(summary, length_field)[name] = int(round(lengths[g]))
+        if count_field is not None:
+            getattr(summary, count_field)[name] = int(counts[g])
+
+
+class SummaryCache(object):
+    """On-disk cache of day summaries, stored in cache/summary.json under tim_dir.
+
+    Day entries are invalidated by the mtime and size of their day file. A manifest of month directories remembers
+    which day files exist, a month is only listed again when the mtime of its directory changes, so missing days of
+    a sparse range cost no stat calls """
+
+    def __init__(self, path: str = None):
+        self.path = data_dir() + "cache/summary.json" if path is None else path
+        self.days = {}
+        self.months = {}
+        self.changed = False
+        self.checked_months = {}
+        try:
+            with open(self.path, 'r') as f:
+                js_obj = json.load(f)
+            if js_obj.get('version') == summary_cache_version:
+                self.days = js_obj['days']
+                self.months = js_obj['months']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def day_exists(self, date: datetime) -> bool:
+        month_key = '{}/{}'.format(date.year, date.month)
+        days = self.checked_months.get(month_key)
+        if days is None:
+            days = self.scan_month(month_key, data_dir() + month_key)
+            self.checked_months[month_key] = days
+        return date.day in days
+
+    def scan_month(self, month_key: str, month_dir: str) -> set:
+        try:
+            mtime = os.stat(month_dir).st_mtime_ns
+        except FileNotFoundError:
+            if self.months.pop(month_key, None) is not None:
+                self.changed = True
+            return set()
+        entry = self.months.get(month_key)
+        if entry is None or entry['mtime'] != mtime:
+            days = []
+            for name in os.listdir(month_dir):
+                if name.endswith('.dat') and name[:-4].isdigit():
+                    days.append(int(name[:-4]))
+            entry = {'mtime': mtime, 'days': sorted(days)}
+            self.months[month_key] = entry
+            self.changed = True
+        return set(entry['days'])
+
+    def lookup(self, date: datetime) -> dict:
+        """Returns the cache entry of the given day if it is still valid, otherwise None """
+        entry = self.days.get(day_cache_key(date))
+        if entry is None:
+            return None
+        try:
+            st = os.stat(date_to_path(date))
+        except FileNotFoundError:
+            return None
+        if entry['mtime'] != st.st_mtime_ns or entry['size'] != st.st_size:
+            return None
+        return entry
+
+    def compute(self, dates: [datetime], jobs: int = 1):
+        """Loads and summarizes the day files of the given dates and stores the results. Long lists are split in
+        chunks over a pool of <jobs> processes, short ones are computed here since starting the pool would cost more
+        than it saves """
+        if len(dates) == 0:
+            return
+        paths = [date_to_path(date) for date in dates]
+        numpy_engine = uses_numpy(len(paths))
+        if jobs > 1 and len(paths) >= parallel_min_days:
+            from concurrent.futures import ProcessPoolExecutor
+            size = -(-len(paths) // (jobs * 4))
+            chunks = [paths[i:i + size] for i in range(0, len(paths), size)]
+            with trace_phase('pool'), ProcessPoolExecutor(min(jobs, len(chunks))) as executor:
+                entries = [entry for chunk in executor.map(day_cache_entries, chunks, [numpy_engine] * len(chunks))
+                           for entry in chunk]
+        else:
+            with trace_phase('aggregate'):
+                entries = day_cache_entries(paths, numpy_engine)
+        for (date, entry) in zip(dates, entries):
+            self.days[day_cache_key(date)] = entry
+        self.changed = True
+
+    def save(self):
+        """Writes the cache back, a data directory that can't be written to (like a colleague's one in a team
+        summary) is just left without a cache """
+        if not self.changed:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': summary_cache_version, 'days': self.days, 'months': self.months}, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            return
+        self.changed = False
+
+
+def day_summaries(first: int, last: int, cache: SummaryCache, review_day, jobs: int = 1):
+    """Yields the summary of every non-empty day from <first> days ago until <last> days ago. Days that are not
+    fully tagged and ended are passed to review_day first, unless it is None. Days missing from the cache are
+    computed together, see SummaryCache.compute """
+    dates = []
+    missing = []
+    for x in range(first, last + 1):
+        date = days_ago(x)
+        if not cache.day_exists(date):
+            continue
+        entry = cache.lookup(date)
+        if review_day is not None and (entry is None or not entry['reviewed']):
+            review_day(date)
+            entry = cache.lookup(date)
+        if entry is None:
+            missing.append(date)
+        dates.append(date)
+
+    cache.compute(missing, jobs)
+    for date in dates:
+        entry = cache.days[day_cache_key(date)]
+        if entry['summary'] is not None:
+            yield DaySummary.from_dict(entry['summary'])
+
+
+def summarize(start: int, end: int, batch: bool = False, output_format: str = 'table', jobs: int = None):
+    """Summarizes days from <start> days ago until <end> days ago. Days are reviewed first unless batch is set, in
+    which case nothing is asked and days are aggregated as they are """
+    review_day = None if batch else (lambda date: review(date, True))
+    with trace_phase('summary'):
+        summary = get_storage().summarize(start, end, review_day, summary_jobs() if jobs is None else jobs)
+    with trace_phase('render'):
+        print_summary(summary, start, end, output_format)
+
+
+def percent(total: int, n: int) -> float:
+    if total == 0:
+        return 0.0
+    return int(n * 1000 / total) / 10
+
+
+def summary_tables(summary: Summary) -> ([tuple], [tuple]):
+    """Returns the tag rows (tag, percent, length, average, count) and issue rows (issue, percent, length) of a
+    summary, longest first """
+    tag_length = summary.tag_length
+    tag_count = summary.tag_count
+    total_hours = sum(tag_length.values())
+
+    tags = []
+    for (tag, le) in sorted(tag_length.items(), key=lambda kv: kv[1], reverse=True):
+        c = tag_count[tag]
+        tags.append((tag, percent(total_hours, le), le, le / c, c))
+
+    issues = []
+    for (issue, le) in sorted(summary.issue_sum.items(), key=lambda kv: kv[1], reverse=True):
+        issues.append((issue, percent(total_hours, le), le))
+    return tags, issues
+
+
+def summary_groups(summary: Summary) -> [tuple]:
+    """Rows (group, percent, length, average, count) of hierarchical tags rolled up into their groups, a group also
+    counts the tag of the same name. Empty when no tag is hierarchical """
+    group_length = {}
+    group_count = {}
+    for (tag, le) in summary.tag_length.items():
+        if tag is None or '/' not in tag:
+            continue
+        for group in tag_groups(tag):
+            add_dict(group_length, group, le)
+            add_dict(group_count, group, summary.tag_count[tag])
+    for group in group_length:
+        if group in summary.tag_length:
+            add_dict(group_length, group, summary.tag_length[group])
+            add_dict(group_count, group, summary.tag_count[group])
+
+    total_hours = sum(summary.tag_length.values())
+    groups = []
+    for (group, le) in sorted(group_length.items(), key=lambda kv: (-kv[1], kv[0])):
+        c = group_count[group]
+        groups.append((group, percent(total_hours, le), le, le / c, c))
+    return groups
+
+
+summary_formats = ('table', 'json', 'csv')
+
+
+def print_summary(summary: Summary, start: int, end: int, output_format: str = 'table'):
+    if output_format == 'json':
+        print_summary_json(summary, start, end)
+    elif output_format == 'csv':
+        print_summary_csv(summary)
+    else:
+        print_summary_table(summary, start, end)
+
+
+def summary_dict(summary: Summary, start: int, end: int) -> dict:
+    (tags, issues) = summary_tables(summary)
+    return {
+        'first_day': days_ago(end).strftime('%Y-%m-%d'),
+        'last_day': days_ago(start).strftime('%Y-%m-%d'),
+        'work_days': summary.work_days,
+        'daily_avg': summary.daily_avg() / 60,
+        'tags': [{'tag': tag, 'percent': p, 'length': le, 'avg': av, 'count': c} for (tag, p, le, av, c) in tags],
+        'issues': [{'issue': issue, 'percent': p, 'length': le} for (issue, p, le) in issues],
+        'groups': [{'group': group, 'percent': p, 'length': le, 'avg': av, 'count': c}
+                   for (group, p, le, av, c) in summary_groups(summary)],
+    }
+
+
+def print_summary_json(summary: Summary, start: int, end: int):
+    print(json.dumps(summary_dict(summary, start, end)))
+
+
+summary_csv_header = ['type', 'name', 'percent', 'length', 'avg', 'count']
+
+
+def summary_rows(summary: Summary) -> [list]:
+    (tags, issues) = summary_tables(summary)
+    rows = [['tag', tag, p, le, av, c] for (tag, p, le, av, c) in tags]
+    rows.extend(['issue', issue, p, le, '', ''] for (issue, p, le) in issues)
+    rows.extend(['group', group, p, le, av, c] for (group, p, le, av, c) in summary_groups(summary))
+    return rows
+
+
+def print_summary_csv(summary: Summary):
+    import csv
+    writer = csv.writer(sys.stdout)
+    writer.writerow(summary_csv_header)
+    writer.writerows(summary_rows(summary))
+
+
+# Activities that were never tagged are summarized under a None tag, shown as this in tables
+untagged_label = '(untagged)'
+
+
+def print_summary_table(summary: Summary, start: int, end: int):
+    (tags, issues) = summary_tables(summary)
+
+    day_format = '%Y %b %d  %A'
+    last_day = days_ago(start).strftime(day_format)
+    first_day = days_ago(end).strftime(day_format)
+
+    print("\n\n")
+    print('First day: {}'.format(first_day))
+    print('Last day : {}'.format(last_day))
+    print('\nWork days : {}'.format(summary.work_days))
+    print("\n-------------------------\n")
+    print("Daily AVG: {}".format(summary.daily_avg() / 60))
+
+    print()
+    print("Tag Distribution:{}Issue Distribution:\n".format(' ' * 57))
+
+    magic = 54
+    gap = 20 * ' '
+    header = " {:^15s} | {:^4s} | {:^9s} | {:^7s} | {:^5s}{} {:^15s} | {:^4s} | {:^6s}".format("Tag", "%", "Length(m)",
+                                                                                               "AVG(m)", "Count", gap,
+                                                                                               'Issue', '%',
+                                                                                               'Length') + gap
+    liner = ('=' * magic) + gap + ('=' * 32)
+    arr = []
+    for (tag, p, le, av, c) in tags:
+        arr.append(" {:^15s} | {:4.1f} | {:^9d} | {:^7.1f} | {:^5d}".format(untagged_label if tag is None else tag, p,
+                                                                            le, av, c))
+
+    arr2 = []
+    for (issue, p, le) in issues:
+        arr2.append(" {:^15s} | {:4.1f} | {:^6d}".format(issue, p, le))
+
+    print(header)
+    print(liner)
+    for i in range(0, max(len(arr), len(arr2))):
+        line = arr[i] if len(arr) > i else ' ' * magic
+        line += gap
+        line += arr2[i] if len(arr2) > i else ' ' * magic
+        print(line)
+
+    groups = summary_groups(summary)
+    if groups:
+        print("\nTag Groups:\n")
+        print(" {:^15s} | {:^4s} | {:^9s} | {:^7s} | {:^5s}".format("Group", "%", "Length(m)", "AVG(m)", "Count"))
+        print('=' * magic)
+        for (group, p, le, av, c) in groups:
+            print(" {:^15s} | {:4.1f} | {:^9d} | {:^7.1f} | {:^5d}".format(group, p, le, av, c))
+
+    print('\n\n')
+
+
+# ------ Team summary
+# Summarizes the data directories of several people, collected on one host. Every directory is summarized by its
+# own worker with its own storage and summary cache, the results are merged into team totals.
+
+def team_roots(paths: [str]) -> [(str, str)]:
+    """(user, data directory) of every path, a home directory stands for its .config/tim and the user is named
+    after the home or data directory """
+    roots = []
+    for path in paths:
+        path = os.path.abspath(os.path.expanduser(path))
+        if os.path.isdir(os.path.join(path, '.config', 'tim')):
+            roots.append((os.path.basename(path), os.path.join(path, '.config', 'tim')))
+        elif os.path.isdir(path):
+            roots.append((os.path.basename(path), path))
+        else:
+            print("Skipping {}: not a directory".format(path), file=sys.stderr)
+    return roots
+
+
+def root_summary(root: str, first: int, last: int, now: datetime) -> Summary:
+    """Summarizes one data directory in batch mode, the unit of work of a team summary. Days are counted back from
+    <now>, the time of the caller, so every worker summarizes the same days whatever its own clock says """
+    with using(Context(root, lambda: now)):
+        return get_storage().summarize(first, last, None, 1)
+
+
+def team_summary(start: int, end: int, paths: [str], output_format: str = 'table', jobs: int = None):
+    """Summarizes every directory with up to <jobs> worker processes, one directory per task. A directory that fails
+    to summarize, whatever the error, is reported as failed and left out of the team totals """
+    roots = team_roots(paths)
+    jobs = max(1, min(summary_jobs() if jobs is None else jobs, len(roots)))
+    now = current_time()
+    results = []
+    failed = []
+    with trace_phase('summary'):
+        if jobs > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(jobs) as executor:
+                futures = [(user, executor.submit(root_summary, root, start, end, now)) for (user, root) in roots]
+                for (user, future) in futures:
+                    try:
+                        results.append((user, future.result()))
+                    except Exception as e:
+                        failed.append((user, e))
+        else:
+            for (user, root) in roots:
+                try:
+                    results.append((user, root_summary(root, start, end, now)))
+                except Exception as e:
+                    failed.append((user, e))
+    for (user, e) in failed:
+        print("Failed to summarize {}: {}: {}".format(user, type(e).__name__, e), file=sys.stderr)
+
+    team = Summary()
+    for (_, summary) in results:
+        team.merge(summary)
+    with trace_phase('render'):
+        if output_format == 'json':
+            js_obj = summary_dict(team, start, end)
+            js_obj['users'] = [dict(summary_dict(summary, start, end), user=user) for (user, summary) in results]
+            js_obj['failed'] = [{'user': user, 'error': str(e)} for (user, e) in failed]
+            print(json.dumps(js_obj))
+        elif output_format == 'csv':
+            import csv
+            writer = csv.writer(sys.stdout)
+            writer.writerow(['user'] + summary_csv_header)
+            for (user, summary) in results:
+                writer.writerows([user] + row for row in summary_rows(summary))
+            writer.writerows(['*'] + row for row in summary_rows(team))
+        else:
+            print_team_users(results, failed)
+            print_summary_table(team, start, end)
+
+
+def print_team_users(results: [(str, Summary)], failed: [(str, Exception)] = ()):
+    print("\n")
+    print(" {:^15s} | {:^9s} | {:^12s} | {:^9s} | {:^15s}".format("User", "Work days", "Daily AVG(h)", "Tagged(h)",
+                                                                 "Top tag"))
+    print('=' * 73)
+    for (user, summary) in results:
+        tagged = sum(summary.tag_length.values())
+        top = max(summary.tag_length.items(), key=lambda kv: kv[1])[0] if summary.tag_length else None
+        print(" {:^15s} | {:^9d} | {:^12.1f} | {:^9.1f} | {:^15s}".format(user, summary.work_days,
+                                                                       summary.daily_avg() / 60, tagged / 60,
+                                                                       str(top or '')))
+    for (user, _) in failed:
+        print(" {:^15s} | {:^9s} |".format(user, "failed"))
+
+
+# ------ Storage
+
+def date_key(date: datetime) -> int:
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+def key_date(key: int) -> datetime:
+    return datetime(key // 10000, key // 100 % 100, key % 100)
+
+
+class FileStorage(object):
+    """Default storage, one json line per sample in a file per day: tim_dir/YYYY/M/D.dat. The (inode, size) of the
+    days it loads is remembered, so saving a day keeps the samples appended while it was being reviewed or synced """
+    name = 'file'
+    summary_cache = None
+
+    def __init__(self):
+        self.bases = {}
+
+    def load(self, date: datetime) -> [Sample]:
+        with DataLock():
+            return load_file(date_to_path(date), self.bases)
+
+    def load_batch(self, date: datetime) -> SampleBatch:
+        with DataLock():
+            return load_batch(date_to_path(date), self.bases)
+
+    def last(self, date: datetime, count: int = 1) -> [Sample]:
+        return load_last(date_to_path(date), count)
+
+    def append(self, date: datetime, sample: Sample):
+        offset = insert_sample(sample, date_to_path(date))
+        index_sample(date, offset, sample)
+
+    def save(self, date: datetime, samples: [Sample]):
+        path = date_to_path(date)
+        touch(path)
+        save_file(samples, path, base=self.bases.pop(path, None))
+        index_day(date)
+
+    def backup(self, date: datetime):
+        import shutil
+        path = date_to_path(date)
+        if os.path.exists(path):
+            shutil.copyfile(path, path + "_back")
+
+    def edit(self, date: datetime):
+        path = date_to_path(date)
+        if not is_record_file(path):
+            open_editor(path)
+            index_day(date)
+            return
+        import tempfile
+        (fd, tmp_path) = tempfile.mkstemp(suffix='.dat')
+        os.close(fd)
+        try:
+            save_file(load_file(path), tmp_path, False)
+            open_editor(tmp_path)
+            save_file(load_file(tmp_path), path, True)
+        finally:
+            os.remove(tmp_path)
+        index_day(date)
+
+    def dates(self) -> [datetime]:
+        res = []
+        for year in os.listdir(data_dir()) if os.path.isdir(data_dir()) else []:
+            if not year.isdigit():
+                continue
+            for month in os.listdir(data_dir() + year):
+                if not month.isdigit():
+                    continue
+                for name in os.listdir(data_dir() + year + '/' + month):
+                    if name.endswith('.dat') and name[:-4].isdigit():
+                        res.append(datetime(int(year), int(month), int(name[:-4])))
+        return sorted(res)
+
+    def summarize(self, first: int, last: int, review_day, jobs: int = 1) -> Summary:
+        cache = SummaryCache() if self.summary_cache is None else self.summary_cache
+        cache.checked_months = {}
+        summary = Summary()
+        try:
+            for day in day_summaries(first, last, cache, review_day, jobs):
+                summary.add_day(day)
+        finally:
+            cache.save()
+        return summary
+
+
+class SqliteStorage(object):
+    """Stores all samples in a single sqlite database, tim_dir/tim.db. Samples are keyed by (day, seq) and indexed by
+    tag and issue, summaries are computed by the database """
+    name = 'sqlite'
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS samples (
+            day INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            minutes INTEGER NOT NULL,
+            message TEXT,
+            tag TEXT,
+            command TEXT,
+            jira_sync INTEGER NOT NULL DEFAULT 0,
+            jira_skip INTEGER NOT NULL DEFAULT 0,
+            issue TEXT,
+            PRIMARY KEY (day, seq)
+        );
+        CREATE INDEX IF NOT EXISTS samples_tag ON samples (tag, day);
+        CREATE INDEX IF NOT EXISTS samples_issue ON samples (issue, day);
+    """
+
+    # Pairs every sample with the next one of the same day. term is 1 when the next sample has another tag, which
+    # closes the current run of equally tagged activities, see summarize_day()
+    pairs_query = """
+        WITH pairs AS (
+            SELECT day, seq, tag, issue, LEAD(seq) OVER w AS next_seq, LEAD(minutes) OVER w - minutes AS d,
+                   CASE WHEN LEAD(tag) OVER w IS tag THEN 0 ELSE 1 END AS term
+            FROM samples WHERE day BETWEEN ? AND ?
+            WINDOW w AS (PARTITION BY day ORDER BY seq)
+        )
+    """
+
+    tags_query = pairs_query + """,
+        runs AS (
+            SELECT day, seq, tag, d, term,
+                   COALESCE(SUM(term) OVER (PARTITION BY day ORDER BY seq
+                                            ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS run
+            FROM pairs WHERE next_seq IS NOT NULL
+        )
+        SELECT tag, SUM(total), COUNT(*), MAX(day * 100000 - end_seq) AS first_seen
+        FROM (SELECT day, run, tag, SUM(d) AS total, MAX(term) AS closed, MAX(seq) AS end_seq
+              FROM runs GROUP BY day, run)
+        WHERE closed = 1
+        GROUP BY tag ORDER BY first_seen DESC
+    """
+
+    issues_query = pairs_query + """
+        SELECT issue, SUM(d), MAX(day * 100000 - seq) AS first_seen
+        FROM pairs WHERE next_seq IS NOT NULL AND issue IS NOT NULL
+        GROUP BY issue ORDER BY first_seen DESC
+    """
+
+    days_query = """
+        SELECT COUNT(*), COALESCE(SUM(l.minutes - f.minutes), 0)
+        FROM (SELECT day, MIN(seq) AS first_seq, MAX(seq) AS last_seq
+              FROM samples WHERE day BETWEEN ? AND ? GROUP BY day) AS b
+        JOIN samples AS f ON f.day = b.day AND f.seq = b.first_seq
+        JOIN samples AS l ON l.day = b.day AND l.seq = b.last_seq
+    """
+
+    unreviewed_query = """
+        SELECT day FROM samples AS s WHERE day BETWEEN ? AND ? GROUP BY day
+        HAVING SUM(message IS NOT NULL AND tag IS NULL) > 0
+            OR (SELECT command FROM samples WHERE day = s.day ORDER BY seq DESC LIMIT 1) IS NULL
+        ORDER BY day DESC
+    """
+
+    def __init__(self, path: str = None):
+        with trace_phase('imports'):
+            import sqlite3
+        self.path = data_dir() + "tim.db" if path is None else path
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(self.schema)
+
+    @staticmethod
+    def row(key: int, seq: int, sample: Sample) -> tuple:
+        issue = issue_of(sample.message)
+        return (key, seq, sample.minutes, sample.message, sample.tag, sample.command, sample.jira_sync,
+                sample.jira_skip, issue)
+
+    def rows(self, date: datetime):
+        return self.db.execute('SELECT minutes, message, tag, command, jira_sync, jira_skip FROM samples '
+                               'WHERE day = ? ORDER BY seq', (date_key(date),))
+
+    def load(self, date: datetime) -> [Sample]:
+        return [Sample(m, message, tag, command, bool(sync), bool(skip))
+                for (m, message, tag, command, sync, skip) in self.rows(date)]
+
+    def load_batch(self, date: datetime) -> SampleBatch:
+        batch = SampleBatch()
+        for (m, message, tag, command, sync, skip) in self.rows(date):
+            batch.minutes.append(m)
+            batch.messages.append(message)
+            batch.tags.append(tag)
+            batch.commands.append(command)
+            batch.jira_sync.append(sync)
+            batch.jira_skip.append(skip)
+        return batch
+
+    def last(self, date: datetime, count: int = 1) -> [Sample]:
+        rows = self.db.execute('SELECT minutes, message, tag, command, jira_sync, jira_skip FROM samples '
+                               'WHERE day = ? ORDER BY seq DESC LIMIT ?', (date_key(date), count)).fetchall()
+        return [Sample(m, message, tag, command, bool(sync), bool(skip))
+                for (m, message, tag, command, sync, skip) in reversed(rows)]
+
+    def append(self, date: datetime, sample: Sample):
+        # the next seq is read by the insert itself, so concurrent appends can't pick the same one
+        key = date_key(date)
+        row = self.row(key, None, sample)
+        with self.db:
+            self.db.execute('INSERT INTO samples SELECT ?, COALESCE(MAX(seq) + 1, 0), ?, ?, ?, ?, ?, ?, ? '
+                            'FROM samples WHERE day = ?', row[:1] + row[2:] + (key,))
+
+    def save(self, date: datetime, samples: [Sample]):
+        key = date_key(date)
+        with self.db:
+            self.db.execute('DELETE FROM samples WHERE day = ?', (key,))
+            self.db.executemany('INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                [self.row(key, seq, sample) for (seq, sample) in enumerate(samples)])
+
+    def backup(self, date: datetime):
+        pass
+
+    def edit(self, date: datetime):
+        """Opens the day in the editor as a temporary json lines file and stores it back """
+        import tempfile
+        (fd, path) = tempfile.mkstemp(suffix='.dat')
+        os.close(fd)
+        try:
+            save_file(self.load(date), path, False)
+            open_editor(path)
+            self.save(date, load_file(path))
+        finally:
+            os.remove(path)
+
+    def dates(self) -> [datetime]:
+        return [key_date(key) for (key,) in self.db.execute('SELECT DISTINCT day FROM samples ORDER BY day')]
+
+    def summarize(self, first: int, last: int, review_day, jobs: int = 1) -> Summary:
+        bounds = (date_key(days_ago(last)), date_key(days_ago(first)))
+        if review_day is not None:
+            for (key,) in self.db.execute(self.unreviewed_query, bounds).fetchall():
+                review_day(key_date(key))
+
+        summary = Summary()
+        (summary.work_days, summary.total_day_length) = self.db.execute(self.days_query, bounds).fetchone()
+        for (tag, le, count, _) in self.db.execute(self.tags_query, bounds):
+            summary.tag_length[tag] = le
+            summary.tag_count[tag] = count
+        for (issue, le, _) in self.db.execute(self.issues_query, bounds):
+            summary.issue_sum[issue] = le
+        return summary
+
+
+storages = {'file': FileStorage, 'sqlite': SqliteStorage}
+
+
+def storage_config_path() -> str:
+    return data_dir() + "storage"
+
+
+def get_storage():
+    """Returns the configured storage, the name of the backend is kept in tim_dir/storage and defaults to file """
+    ctx = context()
+    if ctx.storage is None:
+        name = 'file'
+        try:
+            with open(storage_config_path(), 'r') as f:
+                name = f.readline().strip() or 'file'
+        except FileNotFoundError:
+            pass
+        if name not in storages:
+            raise RuntimeError("Unknown storage '{}' in {}".format(name, storage_config_path()))
+        ctx.storage = storages[name]()
+    return ctx.storage
+
+
+def migrate_storage(name: str):
+    """Copies every day from the current storage into the given one and makes it the configured storage """
+    if name not in storages:
+        print("Unknown storage '{}', expected one of: {}".format(name, ", ".join(storages)))
+        return
+    source = get_storage()
+    if source.name == name:
+        print("Storage is already {}".format(name))
+        return
+    target = storages[name]()
+    count = 0
+    for date in source.dates():
+        samples = source.load(date)
+        if samples:
+            target.save(date, samples)
+            count += 1
+    touch(storage_config_path())
+    with open(storage_config_path(), 'w') as f:
+        f.write(name + "\n")
+    context().storage = target
+    print("Migrated {} days to {} storage.".format(count, name))
+
+
+# ------ Search index
+# Opt-in inverted index of the file storage in tim_dir/index, created by the first --find. Message words, issue keys
+# and tags (as tag:NAME, with their groups) map to postings "token day generation offset", the byte offset of the
+# sample in its day file. Postings go to one of index_shards shards picked by a hash of the token, so a query only
+# reads the shards of its terms. A shard is a sorted file, searched by bisection, and a log the new postings are
+# appended to. Once the log outgrows index_log_limit it is merged into the sorted file. Rewriting a day moves it to
+# its next generation in index/generations, the postings of older generations are ignored and dropped by the merge
+# along with those of removed days. Every hit is also checked against the day file, so a stale posting is never shown.
+
+index_shards = 64
+index_log_limit = 64 * 1024
+token_pattern = re.compile(r'#?\w[\w-]*')
+
+
+def index_dir() -> str:
+    return data_dir() + "index/"
+
+
+def index_enabled() -> bool:
+    return os.path.isdir(index_dir())
+
+
+def sample_tokens(sample: Sample) -> set:
+    tokens = set()
+    if sample.message is not None:
+        tokens.update(token_pattern.findall(sample.message.lower()))
+    if sample.tag is not None:
+        tag = sample.tag.lower()
+        tokens.add('tag:' + tag)
+        tokens.update('tag:' + group for group in tag_groups(tag))
+    return tokens
+
+
+def query_tokens(terms: [str]) -> set:
+    tokens = set()
+    for term in terms:
+        if term.lower().startswith('tag:'):
+            tokens.add(term.lower())
+        else:
+            tokens.update(token_pattern.findall(term.lower()))
+    return tokens
+
+
+def index_shard(token: str) -> str:
+    """The path of the shard of a token, without the .idx or .log extension """
+    import zlib
+    return '{}{:02x}'.format(index_dir(), zlib.crc32(token.encode('utf-8')) % index_shards)
+
+
+def day_generations() -> {int: int}:
+    """The generation of every day key rewritten since the index was built, the other days are at generation 0 """
+    generations = {}
+    try:
+        with open(index_dir() + 'generations', 'r') as f:
+            for line in f:
+                (key, generation) = line.split('\t')
+                generations[int(key)] = int(generation)
+    except FileNotFoundError:
+        pass
+    return generations
+
+
+def add_postings(postings):
+    """Appends postings, an iterable of (day key, generation, offset, sample), with one O_APPEND write per shard log,
+    then merges the logs that have grown past index_log_limit """
+    shards = {}
+    for (key, generation, offset, sample) in postings:
+        for token in sample_tokens(sample):
+            line = '{}\t{}\t{}\t{}\n'.format(token, key, generation, offset)
+            shards.setdefault(index_shard(token), []).append(line)
+    full = []
+    with DataLock():
+        for (shard, lines) in shards.items():
+            fd = os.open(shard + '.log', os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, ''.join(lines).encode('utf-8'))
+                if os.fstat(fd).st_size > index_log_limit:
+                    full.append(shard)
+            finally:
+                os.close(fd)
+    if full:
+        compact_shards(full)
+
+
+def compact_shards(shards: [str]):
+    """Merges the logs of the shards into their sorted files, dropping duplicates and the postings of older
+    generations and of removed days """
+    with DataLock(True):
+        generations = day_generations()
+        days = {}
+        for shard in shards:
+            lines = set()
+            for path in (shard + '.idx', shard + '.log'):
+                try:
+                    with open(path, 'rb') as f:
+                        lines.update(f.read().split(b'\n'))
+                except FileNotFoundError:
+                    pass
+            lines.discard(b'')
+            kept = []
+            for line in lines:
+                (_, key, generation, _) = line.split(b'\t')
+                key = int(key)
+                if int(generation) != generations.get(key, 0):
+                    continue
+                if key not in days:
+                    days[key] = os.path.exists(date_to_path(key_date(key)))
+                if days[key]:
+                    kept.append(line)
+            kept.sort()
+            with open(shard + '.tmp', 'wb') as f:
+                f.write(b''.join(line + b'\n' for line in kept))
+            os.replace(shard + '.tmp', shard + '.idx')
+            try:
+                os.remove(shard + '.log')
+            except FileNotFoundError:
+                pass
+
+
+def day_postings(date: datetime, generation: int):
+    path = date_to_path(date)
+    if not os.path.exists(path):
+        return
+    key = date_key(date)
+    for (offset, sample) in load_offsets(path):
+        yield key, generation, offset, sample
+
+
+def index_sample(date: datetime, offset: int, sample: Sample):
+    if index_enabled():
+        key = date_key(date)
+        add_postings([(key, day_generations().get(key, 0), offset, sample)])
+
+
+def index_day(date: datetime):
+    """Indexes a rewritten day in its next generation """
+    if index_enabled():
+        key = date_key(date)
+        generation = day_generations().get(key, 0) + 1
+        with open(index_dir() + 'generations', 'a') as f:
+            f.write('{}\t{}\n'.format(key, generation))
+        add_postings(day_postings(date, generation))
+
+
+def rebuild_index():
+    """Indexes every day from scratch, in sorted shards without the postings left behind by rewritten days """
+    import shutil
+    shutil.rmtree(index_dir(), ignore_errors=True)
+    os.makedirs(index_dir())
+    storage = FileStorage()
+    add_postings(posting for date in storage.dates() for posting in day_postings(date, 0))
+    shards = ['{}{:02x}'.format(index_dir(), i) for i in range(index_shards)]
+    compact_shards([shard for shard in shards if os.path.exists(shard + '.log')])
+
+
+def shard_postings(token: str) -> [bytes]:
+    """The posting lines of a token: a bisection of the memory mapped sorted file of its shard, then a scan of its
+    log """
+    import mmap
+    prefix = (token + '\t').encode('utf-8')
+    shard = index_shard(token)
+    found = []
+    try:
+        with open(shard + '.idx', 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size > 0 else b''
+    except FileNotFoundError:
+        data = b''
+    (low, high) = (0, len(data))
+    while low < high:
+        middle = (low + high) // 2
+        start = data.rfind(b'\n', 0, middle) + 1
+        end = data.find(b'\n', start)
+        if data[start:end] < prefix:
+            low = end + 1
+        else:
+            high = start
+    while data[low:low + len(prefix)] == prefix:
+        end = data.find(b'\n', low)
+        found.append(data[low:end])
+        low = end + 1
+    if data:
+        data.close()
+    try:
+        with open(shard + '.log', 'rb') as f:
+            found.extend(line for line in f.read().split(b'\n') if line.startswith(prefix))
+    except FileNotFoundError:
+        pass
+    return found
+
+
+def index_lookup(tokens: set) -> {int: set}:
+    """The offsets per day key of the samples of the current generations having all tokens """
+    generations = day_generations()
+    hits = None
+    for token in tokens:
+        found = set()
+        for line in shard_postings(token):
+            (_, key, generation, offset) = line.split(b'\t')
+            key = int(key)
+            if int(generation) == generations.get(key, 0):
+                found.add((key, int(offset)))
+        hits = found if hits is None else hits & found
+        if not hits:
+            return {}
+    days = {}
+    for (key, offset) in hits:
+        days.setdefault(key, set()).add(offset)
+    return days
+
+
+def load_offsets(path: str) -> [(int, Sample)]:
+    """The samples of a day file with the byte offsets where they start in the file """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.startswith(record_magic):
+        batch = SampleBatch()
+        offsets = array('L')
+        decode_records(data, batch, offsets)
+        return list(zip(offsets, batch))
+    res = []
+    offset = 0
+    for line in data.splitlines(keepends=True):
+        if line.strip() != b'':
+            res.append((offset, Sample.from_json(line.decode('utf-8').strip())))
+        offset += len(line)
+    return res
+
+
+def sample_duration(samples: [Sample], i: int, date: datetime) -> int:
+    """Minutes until the next sample, or until now for the running activity of today, None when unknown """
+    if i + 1 < len(samples):
+        return samples[i + 1].minutes - samples[i].minutes
+    now = current_time()
+    if date_key(date) == date_key(now):
+        return now.hour * 60 + now.minute - samples[i].minutes
+    return None
+
+
+def find_matches(tokens: set) -> [(datetime, Sample, int)]:
+    """(date, sample, duration) of the samples having all tokens, in order. The file storage answers from the index,
+    which is built on first use, other storages are scanned """
+    storage = get_storage()
+    if storage.name != 'file':
+        dates = storage.dates()
+        hits = None
+    else:
+        if not index_enabled():
+            rebuild_index()
+        hits = index_lookup(tokens)
+        dates = [key_date(key) for key in sorted(hits)]
+    matches = []
+    for date in dates:
+        if hits is None:
+            samples = storage.load(date)
+            found = range(len(samples))
+        else:
+            try:
+                day = load_offsets(date_to_path(date))
+            except FileNotFoundError:
+                continue
+            samples = [sample for (_, sample) in day]
+            wanted = hits[date_key(date)]
+            found = [i for (i, (offset, _)) in enumerate(day) if offset in wanted]
+        for i in found:
+            if tokens <= sample_tokens(samples[i]):
+                matches.append((date, samples[i], sample_duration(samples, i, date)))
+    return matches
+
+
+def find(terms: [str]):
+    tokens = query_tokens(terms)
+    if not tokens:
+        print("Expected at least one word to search for")
+        return
+    if get_storage().name == 'file' and not index_enabled():
+        print("Building the search index...")
+    total = 0
+    matches = find_matches(tokens)
+    for (date, sample, duration) in matches:
+        if duration is None:
+            print("{}  {}".format(date.strftime('%Y/%m/%d'), sample))
+        else:
+            total += duration
+            print("{}  {}  ({}h {:02d}m)".format(date.strftime('%Y/%m/%d'), sample, duration // 60, duration % 60))
+    print("\n{} activities, {}h {:02d}m".format(len(matches), total // 60, total % 60))
+
+
+# ------ Export
+
+export_formats = ('csv', 'jsonl')
+export_fields = ('date', 'start', 'end', 'duration', 'tag', 'issue', 'message', 'jira_sync', 'jira_skip')
+
+
+def export_rows(first: int, last: int):
+    """Yields a row per activity from <last> days ago until <first> days ago, oldest first, one day in memory at a
+    time. The duration runs until the next sample like in summaries, it is None for a day's open last activity. The
+    issue is the Jira key that t -j sends the worklog to """
+    storage = get_storage()
+    prefix = jira_prefix()
+    for x in range(last, first - 1, -1):
+        date = days_ago(x)
+        day = storage.load_batch(date)
+        minutes = day.minutes
+        messages = day.messages
+        for i in range(len(day)):
+            message = messages[i]
+            if message is None:
+                continue
+            end = minutes[i + 1] if i + 1 < len(day) else None
+            yield (date.strftime('%Y-%m-%d'), minutes_to_time(minutes[i]),
+                   None if end is None else minutes_to_time(end), None if end is None else end - minutes[i],
+                   day.tags[i], issue_key(message, prefix), message, bool(day.jira_sync[i]), bool(day.jira_skip[i]))
+
+
+def export(first: int, last: int, output_format: str = 'csv', output_path: str = None):
+    out = sys.stdout if output_path is None else open(output_path, 'w', buffering=1 << 16, newline='')
+    try:
+        if output_format == 'csv':
+            import csv
+            writer = csv.writer(out)
+            writer.writerow(export_fields)
+            writer.writerows(export_rows(first, last))
+        else:
+            for row in export_rows(first, last):
+                out.write(json.dumps(dict(zip(export_fields, row))))
+                out.write("\n")
+        out.flush()
+    except BrokenPipeError:
+        # the reader of stdout stopped early (like head), the rest of the output is dropped
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if output_path is not None:
+            out.close()
+
+
+# ------ Import
+# Events are csv rows with a header or json objects, one per line. An event has a date and a time (like the rows of
+# --export, date and start) or a timestamp (2024-05-01T09:30 or 2024-05-01 09:30), and a message or a command, a tag
+# and the jira flags are optional.
+
+timestamp_pattern = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})[T ](\d{1,2}:\d{1,2})')
+
+
+def import_event(event: dict) -> (datetime, Sample):
+    """The day and the sample of an event, raises ValueError with the reason when it is invalid """
+    timestamp = event.get('timestamp')
+    if timestamp:
+        m = timestamp_pattern.match(timestamp)
+        if m is None:
+            raise ValueError("invalid timestamp '{}'".format(timestamp))
+        (year, month, day, time_of_day) = (int(m.group(1)), int(m.group(2)), int(m.group(3)), m.group(4))
+    else:
+        date = event.get('date') or ''
+        time_of_day = event.get('start') or event.get('time') or ''
+        parts = date.split('-')
+        if len(parts) != 3 or not all(p.isdigit() for p in parts):
+            raise ValueError("invalid date '{}'".format(date))
+        (year, month, day) = map(int, parts)
+    if not validate_end_time(time_of_day, None):
+        raise ValueError("invalid time '{}'".format(time_of_day))
+    message = event.get('message') or None
+    command = event.get('command') or None
+    if (message is None) == (command is None):
+        raise ValueError("expected either a message or a command")
+    return datetime(year, month, day), Sample(time_of_day, message, event.get('tag') or None, command,
+                                              flag_value(event.get('jira_sync')), flag_value(event.get('jira_skip')))
+
+
+def flag_value(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def read_events(f, input_format: str):
+    """Yields (line number, event) of a csv or json lines stream """
+    if input_format == 'csv':
+        import csv
+        reader = csv.DictReader(f)
+        for event in reader:
+            yield reader.line_num, event
+    else:
+        for (number, line) in enumerate(f, 1):
+            if line.strip() != '':
+                try:
+                    yield number, json.loads(line)
+                except ValueError:
+                    yield number, None
+
+
+def import_events(f, input_format: str):
+    """Validates the events of a stream, groups them by day and merges every day into its existing samples in time
+    order, each affected day is written once. Events already in the day file (same time and message) are
+    skipped """
+    defined_tags = load_tags()
+    days = {}
+    (invalid, unknown_tags) = (0, 0)
+    for (number, event) in read_events(f, input_format):
+        try:
+            if not isinstance(event, dict):
+                raise ValueError("not an event")
+            (date, sample) = import_event(event)
+        except (ValueError, RuntimeError) as e:
+            print("line {}: {}".format(number, e))
+            invalid += 1
+            continue
+        if sample.tag is not None and sample.tag not in defined_tags:
+            unknown_tags += 1
+            sample.tag = None
+        days.setdefault(date_key(date), []).append(sample)
+
+    storage = get_storage()
+    (imported, duplicates) = (0, 0)
+    for key in sorted(days):
+        date = key_date(key)
+        samples = storage.load(date)
+        existing = set((sample.minutes, sample.message, sample.command) for sample in samples)
+        new = []
+        for sample in days[key]:
+            if (sample.minutes, sample.message, sample.command) in existing:
+                duplicates += 1
+            else:
+                new.append(sample)
+        if new:
+            storage.save(date, sorted(samples + new, key=lambda sample: sample.minutes))
+            imported += len(new)
+    print("Imported {} events into {} days, skipped {} already logged and {} invalid events.".format(
+        imported, len(days), duplicates, invalid))
+    if unknown_tags:
+        print("{} events had a tag that is not defined, they are imported untagged.".format(unknown_tags))
+
+
+jira_workers = 4
+jira_retries = 4
+jira_backoff = 0.5
+# (connect, read) seconds, a stalled Jira fails the request instead of hanging the sync
+jira_timeout = (10, 60)
+# methods that can be sent again after a failure without risking a second worklog
+jira_idempotent = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+jira_session_max_age = 8 * 3600
+
+
+def jira_base_url(hostname) -> str:
+    if hostname.startswith('http://') or hostname.startswith('https://'):
+        return hostname.rstrip('/') + '/rest/'
+    return 'https://{}/rest/'.format(hostname)
+
+
+def jira_session():
+    """Returns the shared requests session, its connection pool keeps connections to Jira alive between requests and
+    has room for every sync worker """
+    jira_config = context().jira_config
+    if 'session' not in jira_config:
+        import threading
+        with trace_phase('imports'):
+            import requests
+            from requests.adapters import HTTPAdapter
+        jira_config['lock'] = threading.Lock()
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=jira_workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        jira_config['session'] = session
+    return jira_config['session']
+
+
+def jira_request(method: str, url: str, relogin: bool = True, **kwargs):
+    """Sends a request through the shared session with jira_timeout, retrying with exponential backoff. Every method
+    is retried on 429 and on connections that could not be opened. Idempotent ones are also retried on other
+    connection errors, timeouts and 5xx responses; a POST may have been committed by then and is left to the caller.
+    Retry-After is honoured when the server sends it. A 401 means the cached session has expired, it is renewed once
+    with the stored credentials """
+    import time
+    import requests
+    jira_config = context().jira_config
+    session = jira_session()
+    kwargs.setdefault('timeout', jira_timeout)
+    idempotent = method.upper() in jira_idempotent
+    for attempt in range(jira_retries + 1):
+        delay = jira_backoff * (2 ** attempt)
+        generation = jira_config.get('logins', 0)
+        try:
+            request_start = time.perf_counter()
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == jira_retries or not (idempotent or not_sent(e)):
+                raise
+        else:
+            if trace_enabled:
+                trace_count('http_requests')
+                trace_latencies.append(time.perf_counter() - request_start)
+                add_trace_time('http', trace_latencies[-1])
+            if response.status_code == 401 and relogin and renew_jira_session(generation):
+                return jira_request(method, url, False, **kwargs)
+            retried = response.status_code == 429 or (idempotent and response.status_code >= 500)
+            if not retried or attempt == jira_retries:
+                return response
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = int(retry_after)
+        time.sleep(delay)
+
+
+def not_sent(error: IOError) -> bool:
+    """Whether a failed request never reached the server: the connection could not be opened """
+    import requests
+    from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, (ConnectTimeoutError, NewConnectionError))
+
+
+def test_jira_connection(hostname, username, password) -> bool:
+    jira_session().cookies.clear()
+    r1 = jira_request('POST', jira_base_url(hostname) + 'auth/1/session', False,
+                      json={'username': username, 'password': password})
+    r2 = jira_request('GET', jira_base_url(hostname) + 'auth/1/session', False)
+    notify("{} {}".format(r1.status_code, r2.status_code))
+    return r2.status_code == 200
+
+
+def jira_session_path() -> str:
+    return data_dir() + "jira_session"
+
+
+def save_jira_session(hostname: str):
+    """Stores the cookies of the session next to the jira config, readable only by the user. The session is
+    considered valid until the first cookie expires, or for jira_session_max_age when cookies have no expiry """
+    import time
+    cookies = [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'expires': c.expires,
+                'secure': c.secure} for c in jira_session().cookies]
+    expires = [c['expires'] for c in cookies if c['expires']]
+    data = {'host': hostname, 'expires': min(expires + [int(time.time()) + jira_session_max_age]), 'cookies': cookies}
+    touch(jira_session_path())
+    fd = os.open(jira_session_path(), os.O_WRONLY | os.O_TRUNC)
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+
+
+def load_jira_session(hostname: str) -> bool:
+    """Loads the cookies stored by save_jira_session, returns False when there is no valid session for hostname """
+    import time
+    try:
+        with open(jira_session_path(), 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if data.get('host') != hostname or data.get('expires', 0) <= time.time() or not data.get('cookies'):
+        return False
+    session = jira_session()
+    for c in data['cookies']:
+        session.cookies.set(c['name'], c['value'], domain=c['domain'], path=c['path'], expires=c['expires'],
+                            secure=c['secure'])
+    return True
+
+
+def clear_jira_session():
+    jira_config = context().jira_config
+    if os.path.exists(jira_session_path()):
+        os.remove(jira_session_path())
+    if 'session' in jira_config:
+        jira_config['session'].cookies.clear()
+
+
+def renew_jira_session(generation: int) -> bool:
+    """Logs in again with the credentials given to jira_connect. Workers that get a 401 for the same session
+    generation share a single login """
+    jira_config = context().jira_config
+    if 'credentials' not in jira_config:
+        return False
+    with jira_config['lock']:
+        if jira_config.get('logins', 0) == generation:
+            (hostname, username, password) = jira_config['credentials']
+            if not test_jira_connection(hostname, username, password):
+                return False
+            save_jira_session(hostname)
+            jira_config['logins'] = generation + 1
+    return True
+
+
+def jira_prefix() -> str:
+    """The issue prefix of the Jira session, or the one saved by t -j, None when there is none """
+    if 'prefix' in context().jira_config:
+        return context().jira_config['prefix']
+    try:
+        with open(data_dir() + "jira", "r") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return None
+    return lines[3].strip() if len(lines) > 3 else None
+
+
+def jira_connect() -> bool:
+    """Sets up the Jira session from the saved credentials and session cookies, asking for the missing ones. A context
+    that is not interactive fails instead of asking """
+    path = data_dir() + "jira"
+    jira_config = context().jira_config
+    interactive = context().interactive
+    input_flag = False
+    if not os.path.exists(path):
+        if not interactive:
+            return False
+        hostname = input('Please enter Jira hostname\n')
+        username = input('Please enter Jira username\n')
+        password = input('Please enter Jira password\n')
+        prefix = input('Please enter Jira prefix\n')
+        input_flag = True
+    else:
+        with open(path, "r") as f:
+            hostname = f.readline().strip()
+            username = f.readline().strip()
+            password = f.readline().strip()
+            prefix = f.readline().strip()
+
+    jira_config['prefix'] = prefix
+    jira_config['host'] = hostname
+    jira_config['credentials'] = (hostname, username, password)
+    if not input_flag and load_jira_session(hostname):
+        return True
+
+    while not test_jira_connection(hostname, username, password):
+        if interactive and get_yes_no("Jira connection test failed, Retry?"):
+            hostname = input('Please enter Jira hostname\n')
+            username = input('Please enter Jira username\n')
+            password = input('Please enter Jira password\n')
+            prefix = input('Please enter Jira prefix\n')
+            input_flag = True
+        else:
+            return False
+
+    notify("Jira connection test -> Successful.")
+    save_jira_session(hostname)
+    if input_flag and get_yes_no("Do you want to save Jira credentials ? (SECURITY WARNING: It would be saved in a "
+                                 "plain text file in your system"):
+        touch(path)
+        with open(path, "w") as f:
+            f.write(hostname + "\n")
+            f.write(username + "\n")
+            f.write(password + "\n")
+            f.write(prefix)
+
+    jira_config['prefix'] = prefix
+    jira_config['host'] = hostname
+    jira_config['credentials'] = (hostname, username, password)
+    return True
+
+
+def sync_jira(first: int, last: int = None, confirm=None) -> dict:
+    """Syncs the issues of the days from <first> days ago until <last> days ago. Every question is asked before
+    anything is sent, confirm(sample) decides instead of asking when it is given. Worklogs that never reached Jira
+    are kept in the outbox, which is drained by the next sync that reaches Jira. Worklogs whose post got no clear
+    answer are kept there too, but only sent again once the user says they are not in Jira.
+    Returns the number of synced, refused, skipped, queued and uncertain worklogs, None when Jira could not be set up
+    """
+    confirm = confirm_jira_sample if confirm is None else confirm
+    last = first if last is None else last
+    offline = False
+    try:
+        if not jira_connect():
+            return None
+    except IOError as e:
+        notify('Jira is unreachable ({}), worklogs will be queued.'.format(e))
+        offline = True
+
+    outbox = JiraOutbox()
+    if not offline and not outbox.drain():
+        offline = True
+
+    storage = get_storage()
+    tzname = local_tzname()
+    changed_days = []
+    pending = []
+    skipped = 0
+    for x in range(first, last + 1):
+        date = days_ago(x)
+        data = storage.load_batch(date)
+        change_flag = False
+        for i in range(len(data) - 1):
+            message = data.messages[i]
+            if issue_of(message) is None or data.jira_sync[i] or data.jira_skip[i]:
+                continue
+            if outbox_id(date, data.minutes[i], message) in outbox.ids:
+                continue
+            change_flag = True
+            sample = data.sample(i)
+            if confirm(sample):
+                pending.append((date, data, i, sample, jira_worklog(date, sample, data.sample(i + 1), tzname)))
+            else:
+                sample.jira_skip = True
+                data.update(i, sample)
+                skipped += 1
+        if change_flag:
+            changed_days.append((date, data))
+
+    worklogs = [worklog for (_, _, _, _, worklog) in pending]
+    results = ['unsent'] * len(worklogs) if offline else post_jira_worklogs(worklogs)
+    queued = []
+    for ((date, data, i, sample, worklog), result) in zip(pending, results):
+        if result in ('unsent', 'uncertain'):
+            queued.append(outbox_entry(date, sample, worklog, result == 'uncertain'))
+        else:
+            sample.jira_sync = result == 'synced'
+            data.update(i, sample)
+
+    outbox.add(queued)
+    for (date, data) in changed_days:
+        storage.save(date, data)
+    counts = {result: results.count(result) for result in ('synced', 'refused')}
+    counts.update(skipped=skipped, queued=results.count('unsent'), uncertain=results.count('uncertain'))
+    if counts['queued']:
+        notify('{} worklogs are queued in the outbox, they will be sent by the next jira sync.'.format(
+            counts['queued']))
+    if counts['uncertain']:
+        notify('{} worklogs may already be in Jira, the next jira sync asks about them before sending them '
+               'again.'.format(counts['uncertain']))
+    return counts
+
+
+def confirm_jira_sample(sample: Sample) -> bool:
+    print("Syncing:")
+    print(sample)
+    return get_yes_no("Do you want to sync this task with jira?")
+
+
+def jira_worklog(file_date: datetime, sample: Sample, other: Sample, tzname: str) -> (str, dict):
+    """Returns the issue key and the worklog body of an issue sample, <other> is the sample that ends it """
+    key = issue_key(sample.message, context().jira_config['prefix'])
+
+    d = diff(sample, other)
+    start_datetime = file_date.replace(hour=sample.hour(), minute=sample.minute()).strftime(
+        '%Y-%m-%dT%H:%M:%S.000') + tzname
+    message = {
+        'comment': sample.message,
+        'timeSpentSeconds': (d * 60),
+        'started': start_datetime
+    }
+    return key, message
+
+
+def post_jira_worklog(worklog: (str, dict)) -> (str, str):
+    """Returns ('synced', None) when the worklog is created, ('refused', warning) when Jira refuses it and
+    ('unsent', None) when the post provably never reached Jira: the connection failed or Jira was still busy (429)
+    after the retries. A timeout or a 5xx reply may come after Jira created the worklog, those are
+    ('uncertain', warning) and must not be sent again without asking """
+    (key, message) = worklog
+    url = jira_base_url(context().jira_config['host']) + 'api/2/issue/{}/worklog'.format(key)
+    uncertain = 'WARNING: No clear answer from Jira for the worklog of {} ({}), it may have been created'
+    try:
+        result = jira_request('POST', url, json=message)
+    except IOError as e:
+        return ('unsent', None) if not_sent(e) else ('uncertain', uncertain.format(key, e))
+    if result.status_code == 201:
+        return 'synced', None
+    if result.status_code == 429:
+        return 'unsent', None
+    if result.status_code >= 500:
+        return 'uncertain', uncertain.format(key, result.status_code)
+    return 'refused', 'WARNING: Could not sync {}, reason: {}  {}'.format(key, result.status_code, result.content)
+
+
+def post_jira_worklogs(worklogs: [(str, dict)]) -> [str]:
+    """Posts worklogs concurrently on at most jira_workers connections. Returns the result of post_jira_worklog for
+    each: 'synced', 'refused', 'unsent' or 'uncertain'. Workers run in copies of the context of the caller, so they
+    share its Jira session """
+    if len(worklogs) == 0:
+        return []
+    from concurrent.futures import ThreadPoolExecutor
+    from contextvars import copy_context
+    with ThreadPoolExecutor(min(jira_workers, len(worklogs))) as executor:
+        futures = [executor.submit(copy_context().run, post_jira_worklog, worklog) for worklog in worklogs]
+        results = [future.result() for future in futures]
+    for (_, warning) in results:
+        if warning is not None:
+            notify(warning)
+    return [result for (result, _) in results]
+
+
+# ------ Jira outbox
+
+jira_outbox_batch = 50
+
+
+def outbox_id(date: datetime, minutes: int, message: str) -> str:
+    return '{}/{}/{} {} {}'.format(date.year, date.month, date.day, minutes, message)
+
+
+def outbox_entry(date: datetime, sample: Sample, worklog: (str, dict), uncertain: bool = False) -> dict:
+    entry = {'id': outbox_id(date, sample.minutes, sample.message), 'date': [date.year, date.month, date.day],
+             'minutes': sample.minutes, 'message': sample.message, 'key': worklog[0], 'worklog': worklog[1]}
+    if uncertain:
+        entry['uncertain'] = True
+    return entry
+
+
+class JiraOutbox(object):
+    """Worklogs waiting for Jira, kept in tim_dir/jira_outbox as one json entry per line. Entries are identified by
+    their day, start and message, so a sample is never queued twice. Uncertain entries, whose post may have been
+    created, are not sent until the user says they are missing from Jira """
+
+    def __init__(self, path: str = None):
+        self.path = data_dir() + "jira_outbox" if path is None else path
+        self.entries = []
+        self.ids = set()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    if line.strip() != '':
+                        entry = json.loads(line)
+                        if entry['id'] not in self.ids:
+                            self.entries.append(entry)
+                            self.ids.add(entry['id'])
+
+    def add(self, entries: [dict]):
+        """Appends entries and flushes them to disk before returning """
+        entries = [entry for entry in entries if entry['id'] not in self.ids]
+        if len(entries) == 0:
+            return
+        touch(self.path)
+        with open(self.path, 'a') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        for entry in entries:
+            self.entries.append(entry)
+            self.ids.add(entry['id'])
+
+    def rewrite(self):
+        if len(self.entries) == 0:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def resolve(self):
+        """Asks about every uncertain entry whether its worklog is in Jira. Those are marked synced and removed, the
+        others are sent like the rest of the outbox. A context that is not interactive leaves them for a later sync """
+        uncertain = [entry for entry in self.entries if entry.get('uncertain')]
+        if len(uncertain) == 0 or not context().interactive:
+            return
+        created = []
+        for entry in uncertain:
+            (year, month, day) = entry['date']
+            if get_yes_no("Jira gave no clear answer to the worklog of {} on {}/{}/{} {}, is it in Jira? ".format(
+                    entry['key'], year, month, day, minutes_to_time(entry['minutes']))):
+                created.append(entry)
+            else:
+                del entry['uncertain']
+        mark_jira_synced(created)
+        ids = set(entry['id'] for entry in created)
+        self.entries = [entry for entry in self.entries if entry['id'] not in ids]
+        self.ids = set(entry['id'] for entry in self.entries)
+        self.rewrite()
+
+    def drain(self) -> bool:
+        """Sends queued worklogs in batches of jira_outbox_batch, after resolving the uncertain ones. Sent entries are
+        marked synced in their days and removed, refused ones are dropped with a warning, the ones that get no clear
+        answer become uncertain. Returns False when Jira could not be reached """
+        self.resolve()
+        waiting = [entry for entry in self.entries if not entry.get('uncertain')]
+        if len(waiting) == 0:
+            return True
+        notify('Sending {} queued worklogs.'.format(len(waiting)))
+        for start in range(0, len(waiting), jira_outbox_batch):
+            batch = waiting[start:start + jira_outbox_batch]
+            results = post_jira_worklogs([(entry['key'], entry['worklog']) for entry in batch])
+            mark_jira_synced([entry for (entry, result) in zip(batch, results) if result == 'synced'])
+            done = set(entry['id'] for (entry, result) in zip(batch, results) if result in ('synced', 'refused'))
+            for (entry, result) in zip(batch, results):
+                if result == 'uncertain':
+                    entry['uncertain'] = True
+            self.entries = [entry for entry in self.entries if entry['id'] not in done]
+            self.ids = set(entry['id'] for entry in self.entries)
+            self.rewrite()
+            if 'unsent' in results:
+                return False
+        return True
+
+
+def mark_jira_synced(entries: [dict]):
+    """Sets jira_sync on the samples of sent outbox entries, each day is saved once """
+    storage = get_storage()
+    days = {}
+    for entry in entries:
+        days.setdefault(tuple(entry['date']), []).append(entry)
+    for (key, day_entries) in days.items():
+        date = datetime(*key)
+        data = storage.load_batch(date)
+        for entry in day_entries:
+            for i in range(len(data)):
+                if data.minutes[i] == entry['minutes'] and data.messages[i] == entry['message'] \
+                        and not data.jira_sync[i]:
+                    data.jira_sync[i] = True
+                    break
+        storage.save(date, data)